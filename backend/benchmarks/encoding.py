@@ -0,0 +1,83 @@
+"""
+Bytes on the wire and CPU per response for the JSON encoders and
+compression settings.
+
+Seeds (or reuses) a SQLite benchmark database and, for a question page
+(full and ?compact=1) and a whole category listing, prints:
+  bytes      identity, gzip and brotli body sizes
+  cpu        process CPU per response (ms) to build it with the standard
+             library json module and with orjson, and to compress it
+The response cache is off, so every request is built from scratch.
+
+    cd backend
+    python -m benchmarks.encoding --size 10000 --requests 200
+"""
+import argparse
+import os
+import time
+
+from benchmarks.seed import use_database, sqlite_url, seed, seeded_size
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+RESPONSES = [
+    ('page', '/api/v1.0/questions?page=2'),
+    ('page compact', '/api/v1.0/questions?page=2&compact=1'),
+    ('category', '/api/v1.0/categories/0/questions'),
+]
+
+
+def cpu_per_call(fn, n):
+    started = time.process_time()
+    for _ in range(n):
+        fn()
+    return (time.process_time() - started) / n * 1000
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=10000, help='questions to seed')
+    parser.add_argument('--requests', type=int, default=200, help='requests per response and encoder')
+    parser.add_argument('--level', type=int, default=6, help='gzip level / brotli quality')
+    parser.add_argument('--data-dir', default=os.path.join(HERE, 'data'), help='where SQLite files are kept')
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    use_database(sqlite_url(args.size, args.data_dir))
+    from flaskr import create_app, encoding
+    from models import db
+
+    app = create_app({'RATE_LIMIT': False, 'RESPONSE_CACHE': False, 'COMPRESS': False})
+    with app.app_context():
+        if seeded_size(db) != args.size:
+            print('seeding {} questions...'.format(args.size), flush=True)
+            seed(db, args.size)
+    client = app.test_client()
+    fast = encoding.fast_json
+
+    print('{} questions, {} requests each{}'.format(
+        args.size, args.requests, '' if fast else ' (orjson not installed)'))
+    print('{:<14} {:>9} {:>9} {:>9}   {:>9} {:>9} {:>9} {:>9}'.format(
+        'response', 'bytes', 'gzip', 'br', 'stdlib', 'orjson', '+gzip', '+br'))
+    for name, url in RESPONSES:
+        body = client.get(url).get_data()
+        sizes = {e: len(encoding.compress(body, e, args.level)) for e in encoding.encodings()}
+        encoding.fast_json = False
+        cpu = {'stdlib': cpu_per_call(lambda: client.get(url), args.requests)}
+        encoding.fast_json = fast
+        cpu['orjson'] = cpu_per_call(lambda: client.get(url), args.requests) if fast else None
+        for e in encoding.encodings():
+            cpu[e] = cpu_per_call(lambda: encoding.compress(body, e, args.level), args.requests)
+
+        def column(value, fmt):
+            return fmt.format(value) if value is not None else '{:>9}'.format('-')
+
+        print('{:<14} {:>9} {} {}   {} {} {} {}'.format(
+            name, len(body), column(sizes.get('gzip'), '{:>9}'), column(sizes.get('br'), '{:>9}'),
+            column(cpu['stdlib'], '{:>7.3f}ms'), column(cpu['orjson'], '{:>7.3f}ms'),
+            column(cpu.get('gzip'), '{:>7.3f}ms'), column(cpu.get('br'), '{:>7.3f}ms')), flush=True)
+    db.get_engine(app).dispose()
+
+
+if __name__ == '__main__':
+    main()
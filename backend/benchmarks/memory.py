@@ -0,0 +1,75 @@
+"""
+Memory footprint of the in-memory question store versus the ORM path.
+
+Seeds (or reuses) a SQLite benchmark database, then measures with
+tracemalloc:
+  store      memory held by a loaded QuestionStore (records, prepared JSON, id arrays)
+  orm        peak memory of hydrating every row as a Question and formatting it,
+             which is what serving the whole table through the ORM allocates
+and prints both per 100k questions.
+
+    cd backend
+    python -m benchmarks.memory --size 100000
+"""
+import argparse
+import os
+import tracemalloc
+
+from benchmarks.seed import use_database, sqlite_url, seed, seeded_size
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def measure(fn):
+    """(bytes still held when fn returns, peak bytes while it ran)."""
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    result = fn()
+    held, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, held - before, peak - before
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=100000, help='questions to seed')
+    parser.add_argument('--data-dir', default=os.path.join(HERE, 'data'), help='where SQLite files are kept')
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    use_database(sqlite_url(args.size, args.data_dir))
+    from flaskr.store import QuestionStore
+    from models import db, setup_db, Question
+    from flask import Flask
+
+    app = Flask(__name__)
+    setup_db(app)
+    with app.app_context():
+        if seeded_size(db) != args.size:
+            print('seeding {} questions...'.format(args.size), flush=True)
+            seed(db, args.size)
+
+        def load_store():
+            store = QuestionStore(lambda: db.session.query(Question.id, Question.question, Question.answer,
+                                                           Question.category, Question.difficulty))
+            store.count()
+            return store
+
+        def load_orm():
+            return [q.format() for q in db.session.query(Question)]
+
+        store, store_held, store_peak = measure(load_store)
+        db.session.remove()
+        rows, orm_held, orm_peak = measure(load_orm)
+        db.session.remove()
+
+    scale = 100000.0 / args.size
+    mb = 1024.0 * 1024.0
+    print('{} questions, per 100k:'.format(args.size))
+    print('  store  held {:8.1f}MB  peak while loading {:8.1f}MB'.format(store_held * scale / mb, store_peak * scale / mb))
+    print('  orm    held {:8.1f}MB  peak while loading {:8.1f}MB'.format(orm_held * scale / mb, orm_peak * scale / mb))
+
+
+if __name__ == '__main__':
+    main()
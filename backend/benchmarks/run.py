@@ -0,0 +1,225 @@
+"""
+Load test for the trivia endpoints.
+
+Seeds a database with generated questions, then drives the read endpoints
+through the Flask test client (no network, one request at a time) and
+through a real threaded WSGI server (concurrent HTTP clients). Reports
+p50/p95/p99 latency, requests/sec and the process's peak RSS, and writes
+the results as JSON so runs from different commits can be compared.
+
+The response cache is off, so every request does the endpoint's work;
+--response-cache turns it on and reports each run's cache hits and misses.
+
+    cd backend
+    python -m benchmarks.run --sizes 1000 100000 --requests 500 --concurrency 8
+    python -m benchmarks.run --sizes 1000 --compare benchmarks/results/bench-<old commit>.json
+
+SQLite files are created under --data-dir; pass --database-url to run
+against a throwaway Postgres database instead (it is dropped and re-seeded).
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+from benchmarks.seed import CATEGORIES, WORDS, use_database, sqlite_url, seed, seeded_size
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def scenarios(size, rng):
+    """(name, method, path, json body) factories for each endpoint under test."""
+    pages = max(1, size // 10)
+    return [
+        ('list_questions', lambda: ('GET', '/api/v1.0/questions?page={}'.format(rng.randint(1, pages)), None)),
+        ('search_questions', lambda: ('POST', '/api/v3.0/questions',
+                                      {'searchTerm': rng.choice(WORDS), 'page': 1})),
+        ('category_questions', lambda: ('GET', '/api/v1.0/categories/{}/questions'.format(
+            rng.randrange(len(CATEGORIES))), None)),
+        ('quiz_next', lambda: ('POST', '/api/v1.1/quizzes', {
+            'previous_questions': [rng.randint(1, size) for _ in range(5)], 'questionsPerPlay': 5,
+            'quiz_category': {'type': 'any', 'id': str(rng.randrange(len(CATEGORIES)))}})),
+    ]
+
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1)
+
+
+def summarize(name, mode, latencies, elapsed, errors):
+    latencies = sorted(latencies)
+    return {
+        'endpoint': name,
+        'mode': mode,
+        'requests': len(latencies),
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'rps': round(len(latencies) / elapsed, 1),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def run_test_client(app, name, make_request, requests):
+    client = app.test_client()
+    latencies, errors = [], 0
+    started = time.perf_counter()
+    for _ in range(requests):
+        method, path, body = make_request()
+        t = time.perf_counter()
+        resp = client.open(path, method=method, json=body)
+        latencies.append(time.perf_counter() - t)
+        errors += resp.status_code != 200
+    return summarize(name, 'test_client', latencies, time.perf_counter() - started, errors)
+
+
+def run_wsgi(port, name, make_request, requests, concurrency):
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    # draw every request up front so the random generator is not shared between threads
+    work = [make_request() for _ in range(requests)]
+
+    def worker(chunk):
+        for method, path, body in chunk:
+            conn = http.client.HTTPConnection('127.0.0.1', port)
+            payload = json.dumps(body) if body is not None else None
+            headers = {'Content-Type': 'application/json'} if body is not None else {}
+            t = time.perf_counter()
+            conn.request(method, path, body=payload, headers=headers)
+            resp = conn.getresponse()
+            resp.read()
+            elapsed = time.perf_counter() - t
+            conn.close()
+            with lock:
+                latencies.append(elapsed)
+                errors[0] += resp.status != 200
+
+    threads = [threading.Thread(target=worker, args=(work[i::concurrency],)) for i in range(concurrency)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return summarize(name, 'wsgi', latencies, time.perf_counter() - started, errors[0])
+
+
+def start_server(app):
+    from werkzeug.serving import make_server
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    before = {(r['size'], r['endpoint'], r['mode']): r for r in baseline['results']}
+    print('\n{:>8} {:<20} {:<12} {:>10} {:>10}'.format('size', 'endpoint', 'mode', 'p95 %', 'rps %'))
+    for r in results:
+        old = before.get((r['size'], r['endpoint'], r['mode']))
+        if old is None:
+            continue
+        p95 = (r['p95_ms'] - old['p95_ms']) / old['p95_ms'] * 100 if old['p95_ms'] else 0.0
+        rps = (r['rps'] - old['rps']) / old['rps'] * 100 if old['rps'] else 0.0
+        print('{:>8} {:<20} {:<12} {:>+10.1f} {:>+10.1f}'.format(r['size'], r['endpoint'], r['mode'], p95, rps))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000], help='question counts to seed, e.g. 1000 100000 1000000')
+    parser.add_argument('--requests', type=int, default=200, help='requests per endpoint and mode')
+    parser.add_argument('--concurrency', type=int, default=8, help='client threads against the WSGI server')
+    parser.add_argument('--endpoints', nargs='+', help='only run these scenarios')
+    parser.add_argument('--database-url', help='run against this database instead of a SQLite file')
+    parser.add_argument('--data-dir', default=os.path.join(HERE, 'data'), help='where SQLite files are kept')
+    parser.add_argument('--response-cache', action='store_true', help='serve repeated requests from the response cache')
+    parser.add_argument('--reseed', action='store_true', help='re-seed even if the database already has size questions')
+    parser.add_argument('--out', help='results file (default benchmarks/results/bench-<commit>.json)')
+    parser.add_argument('--compare', help='earlier results file to print p95/rps changes against')
+    args = parser.parse_args(argv)
+
+    if args.database_url and len(args.sizes) > 1:
+        parser.error('--database-url holds one seeded size at a time')
+
+    commit = git_commit()
+    results = []
+    for size in args.sizes:
+        os.makedirs(args.data_dir, exist_ok=True)
+        use_database(args.database_url or sqlite_url(size, args.data_dir))
+        # settings/models/flaskr read DATABASE_URL on import, so they are (re)loaded per size
+        for module in [m for m in sys.modules if m in ('settings', 'models') or m.startswith('flaskr')]:
+            del sys.modules[module]
+        from flaskr import create_app
+        from models import db
+
+        # every request comes from this one client, so the per-client rate limits are off
+        app = create_app({'RATE_LIMIT': False, 'RESPONSE_CACHE': args.response_cache})
+        cache = app.extensions['response_cache']
+        with app.app_context():
+            if args.reseed or seeded_size(db) != size:
+                print('seeding {} questions...'.format(size), flush=True)
+                print('  {:.1f}s'.format(seed(db, size)), flush=True)
+
+        rng = random.Random(size)
+        server = start_server(app)
+        try:
+            for name, make_request in scenarios(size, rng):
+                if args.endpoints and name not in args.endpoints:
+                    continue
+                for run in (lambda: run_test_client(app, name, make_request, args.requests),
+                            lambda: run_wsgi(server.server_port, name, make_request, args.requests,
+                                             args.concurrency)):
+                    before = cache.stats()
+                    r = run()
+                    after = cache.stats()
+                    r['size'] = size
+                    r['cache_hits'] = after['hits'] - before['hits']
+                    r['cache_misses'] = after['misses'] - before['misses']
+                    results.append(r)
+                    line = ('{size:>8} {endpoint:<20} {mode:<12} p50 {p50_ms:>9.2f}ms  p95 {p95_ms:>9.2f}ms  '
+                            'p99 {p99_ms:>9.2f}ms  {rps:>8.1f} req/s  rss {peak_rss_mb}MB').format(**r)
+                    if args.response_cache:
+                        line += '  cache {cache_hits} hits / {cache_misses} misses'.format(**r)
+                    print(line, flush=True)
+        finally:
+            server.shutdown()
+        db.get_engine(app).dispose()
+
+    out = args.out or os.path.join(HERE, 'results', 'bench-{}.json'.format(commit))
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump({'commit': commit, 'python': platform.python_version(),
+                   'database': args.database_url.split(':')[0] if args.database_url else 'sqlite',
+                   'requests': args.requests, 'concurrency': args.concurrency,
+                   'response_cache': args.response_cache, 'results': results}, f, indent=2)
+    print('wrote ' + out)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
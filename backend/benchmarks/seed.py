@@ -0,0 +1,63 @@
+import os
+import random
+import time
+
+CATEGORIES = ['Science', 'Art', 'Geography', 'History', 'Entertainment', 'Sports']
+WORDS = ('which what who where when how river title movie planet author team country element '
+         'painting album war king queen city ocean mountain novel player record medicine '
+         'heaviest largest first oldest famous ancient modern national world cup').split()
+SEED_BATCH = 10000
+
+"""
+Benchmark databases
+
+use_database(url) must run before flaskr/models/settings are imported,
+because settings reads DATABASE_URL at import time. seed() fills the
+categories of trivia.psql and `size` generated questions.
+"""
+
+
+def use_database(url):
+    os.environ['DATABASE_URL'] = url
+
+
+def sqlite_url(size, directory):
+    return 'sqlite:///' + os.path.abspath(os.path.join(directory, 'bench_{}.db'.format(size)))
+
+
+def make_question(rng, i):
+    text = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(6, 14)))
+    return {'question': '{} #{}?'.format(text.capitalize(), i),
+            'answer': rng.choice(WORDS).capitalize(),
+            'category': rng.randint(1, len(CATEGORIES)),
+            'difficulty': rng.randint(1, 5)}
+
+
+def seed(db, size, rng_seed=1):
+    """Recreates the tables and inserts size questions; returns seconds taken."""
+    from models import Question, Category
+    from flaskr import bulk
+
+    started = time.perf_counter()
+    db.drop_all()
+    db.create_all()
+    db.session.add_all([Category(t) for t in CATEGORIES])
+    db.session.commit()
+    rng = random.Random(rng_seed)
+    for low in range(0, size, SEED_BATCH):
+        rows = [make_question(rng, i) for i in range(low, min(size, low + SEED_BATCH))]
+        # COPY on Postgres, bulk_insert_mappings elsewhere
+        bulk.insert_rows(db.session, Question, rows)
+        db.session.commit()
+    db.session.remove()
+    return time.perf_counter() - started
+
+
+def seeded_size(db):
+    from models import Question
+    try:
+        return db.session.query(Question).count()
+    except Exception:
+        return None
+    finally:
+        db.session.remove()
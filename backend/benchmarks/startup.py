@@ -0,0 +1,69 @@
+"""
+Cold start time of the app, per phase.
+
+Each run is a fresh Python process that times:
+  import   importing settings, models and flaskr (reads .env if there is one)
+  config   create_app(): config, caches, routes; includes the DDL checks with DB_INIT=1
+  engine   the first query, which opens the first pooled connection
+  ddl      init_db(): database_exists, create_all and the search indexes
+Runs are repeated for the default lazy startup and for DB_INIT=1 (the
+schema checked on every start), and the median of each phase is printed.
+
+    cd backend
+    python -m benchmarks.startup --runs 5
+    python -m benchmarks.startup --database-url sqlite:///benchmarks/data/bench_1000.db
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PHASES = ('import', 'config', 'engine', 'ddl')
+
+CHILD = """
+import json, time
+t0 = time.perf_counter()
+from flaskr import create_app
+from models import db, init_db
+t1 = time.perf_counter()
+app = create_app()
+t2 = time.perf_counter()
+with app.app_context():
+    db.session.execute('SELECT 1')
+    t3 = time.perf_counter()
+    init_db(app.config['SQLALCHEMY_DATABASE_URI'])
+    t4 = time.perf_counter()
+print(json.dumps({'import': t1 - t0, 'config': t2 - t1, 'engine': t3 - t2, 'ddl': t4 - t3}))
+"""
+
+
+def run_once(env):
+    out = subprocess.check_output([sys.executable, '-c', CHILD], cwd=os.path.dirname(HERE), env=env,
+                                  stderr=subprocess.DEVNULL)
+    return json.loads(out.decode().strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='processes started per mode')
+    parser.add_argument('--database-url', help='database to start against (default: the configured one)')
+    args = parser.parse_args(argv)
+
+    print('{:<10} {:>10} {:>10} {:>10} {:>10} {:>12}'.format('mode', *PHASES + ('to serve',)))
+    for mode, init in (('lazy', '0'), ('DB_INIT=1', '1')):
+        env = dict(os.environ, DB_INIT=init)
+        if args.database_url:
+            env['DATABASE_URL'] = args.database_url
+        runs = [run_once(env) for _ in range(args.runs)]
+        medians = {p: statistics.median(r[p] for r in runs) * 1000 for p in PHASES}
+        # the ddl column runs after the app is up; it is what a start pays when it checks the schema
+        serve = medians['import'] + medians['config'] + medians['engine']
+        print('{:<10} {:>8.1f}ms {:>8.1f}ms {:>8.1f}ms {:>8.1f}ms {:>10.1f}ms'.format(
+            mode, *[medians[p] for p in PHASES] + [serve]))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,27 +1,59 @@
+import concurrent.futures
 import datetime
+import io
 import os
+import queue
+from collections import OrderedDict
 
+import click
 import flask
-from flask import Flask, request, abort, jsonify, flash, make_response
+from flask import Flask, request, abort, jsonify, flash, make_response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import create_engine, Column, Integer, String
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import Column, Integer, String, func
 
 from flask_cors import CORS
-import random
 import os
-from models import setup_db, Question, Category
-from settings import database_path
+from models import db, setup_db, init_db, Question, Category, Score
+from settings import database_path, DB_INIT
+from flaskr.pagination import CountCache, count_rows, page_by_offset, page_by_keyset
+from flaskr.quiz import QuestionIndex, QuizSessionStore, AdaptiveQuizSession, difficulty_for, DEFAULT_DIFFICULTY
+from flaskr.categories import CategoryCache
+from flaskr.search import make_search
+from flaskr.autocomplete import PrefixIndex
+from flaskr import bulk
+from flaskr.streaming import stream_mode, stream_rows, streamed_response
+from flaskr.instrumentation import instrument
+from flaskr.encoding import setup_encoding, dumps
+from flaskr.response_cache import ResponseCache, make_backend, make_entry, entry_response
+from flaskr.polling import VersionPoll
+from flaskr.store import QuestionStore, QuestionRecord, records_body
+from flaskr.singleflight import SingleFlight
+from flaskr.ratelimit import RateLimiter
+from flaskr.leaderboard import Leaderboard
+from flaskr.writer import BatchWriter
+from flaskr.stats import QuestionStats
+from flaskr.packs import PackCache, build_pack, parse_mix, MAX_PACK_SIZE
 
 SECRET_KEY = os.urandom(32)
 
 # connect to a local trivia database
 SQLALCHEMY_DATABASE_URI = database_path
-engine = create_engine(SQLALCHEMY_DATABASE_URI)
-Session = sessionmaker(bind=engine)
-session = Session()
+# db.session is a scoped_session: every request (thread) gets its own session from the
+# pool set up in setup_db, and Flask-SQLAlchemy removes it in teardown_appcontext
+session = db.session
 
 QUESTIONS_PER_PAGE = 10
+MAX_SUGGESTIONS = 50
+# largest id lists accepted by the batch fetch and batch delete endpoints
+MAX_BATCH_FETCH = 500
+MAX_BATCH_DELETE = 5000
+MAX_LEADERBOARD = 100
+
+
+def json_int(value):
+    # JSON integers only: bools, floats and numeric strings are not silently converted
+    return value if type(value) is int else None
+
 
 """
 @TODO: Set up CORS. Allow '*' for origins. Delete the sample route after completing the TODOs
@@ -32,9 +64,416 @@ def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
     app.config['SECRET_KEY'] = SECRET_KEY
+    # cache total_questions between writes; a ttl (seconds) also bounds staleness
+    # from writes made outside this app
+    app.config['QUESTION_COUNT_CACHE'] = True
+    app.config['QUESTION_COUNT_TTL'] = None
+    # quiz sessions idle for QUIZ_SESSION_TTL seconds are dropped, at most QUIZ_SESSION_MAX are kept,
+    # and together they remember at most QUIZ_SESSION_MAX_IDS served question ids
+    app.config['QUIZ_SESSION_TTL'] = 3600
+    app.config['QUIZ_SESSION_MAX'] = 10000
+    app.config['QUIZ_SESSION_MAX_IDS'] = 1000000
+    # categories are loaded once; a ttl (seconds) reloads them periodically
+    app.config['CATEGORY_CACHE_TTL'] = None
+    # lets any client ask for a cProfile summary with ?profile=1; keep it off in production
+    app.config['ALLOW_PROFILING'] = False
+    # read endpoint responses, dropped when questions change; RESPONSE_CACHE_URL
+    # ('redis://...') shares them and their invalidations between processes, otherwise they
+    # stay in memory, where writes by other processes are only seen once RESPONSE_CACHE_TTL
+    # seconds have passed (None: entries never expire)
+    app.config['RESPONSE_CACHE'] = True
+    app.config['RESPONSE_CACHE_BYTES'] = 32 * 1024 * 1024
+    app.config['RESPONSE_CACHE_URL'] = os.environ.get('RESPONSE_CACHE_URL')
+    app.config['RESPONSE_CACHE_TTL'] = 5
+    # with a shared (Redis) response cache, each process checks its tag version at most every
+    # CACHE_SYNC_INTERVAL seconds and drops its in-memory question caches when another
+    # process changed the questions
+    app.config['CACHE_SYNC_INTERVAL'] = 1
+    # every QUESTION_CACHE_TTL seconds each process compares the questions table's row count and
+    # highest id with what its in-memory question caches were built from, and rebuilds them if
+    # rows were loaded or deleted behind its back (flask import-questions, psql); None: never
+    app.config['QUESTION_CACHE_TTL'] = 60
+    # serve listings and quiz questions from an in-memory copy of the questions table
+    app.config['QUESTION_STORE'] = False
+    # create missing tables and indexes on startup instead of leaving it to `flask init-db`
+    app.config['INIT_DB'] = DB_INIT
+    # identical concurrent searches and category listings share one query
+    app.config['COALESCE_REQUESTS'] = True
+    # token buckets per client and endpoint: endpoint -> (requests per second, burst). Off by
+    # default: behind a proxy every client has the proxy's address, so turn it on together with
+    # RATE_LIMIT_CLIENT_HEADER, the header carrying the client address
+    app.config['RATE_LIMIT'] = False
+    app.config['RATE_LIMITS'] = {
+        'search_by_que': (10, 30),
+        'search_by_cate': (10, 30),
+        'quizzes': (10, 30),
+        'next_quiz_question': (10, 30),
+    }
+    app.config['RATE_LIMIT_CLIENT_HEADER'] = None
+    # write-behind: submit_que queues new questions and a background thread inserts them in
+    # group commits of up to WRITE_BEHIND_BATCH rows or every WRITE_BEHIND_DELAY_MS; the request
+    # still answers with the committed id
+    app.config['WRITE_BEHIND'] = False
+    app.config['WRITE_BEHIND_BATCH'] = 500
+    app.config['WRITE_BEHIND_DELAY_MS'] = 10
+    app.config['WRITE_BEHIND_QUEUE'] = 10000
+    app.config['WRITE_BEHIND_TIMEOUT'] = 10
+    # scores are always written behind; POST /scores waits up to SCORE_WRITE_TIMEOUT seconds
+    # for the game to be stored and ranked
+    app.config['SCORE_WRITE_TIMEOUT'] = 10
+    # each process ranks games in its own leaderboard, rebuilt from the scores table after
+    # LEADERBOARD_TTL seconds to pick up games stored by other processes (None: never)
+    app.config['LEADERBOARD_TTL'] = 60
+    # encoded quiz packs kept in memory, least recently used dropped first
+    app.config['QUIZ_PACKS_MAX'] = 1000
+    # gzip/brotli for JSON, NDJSON, CSV and text responses of COMPRESS_MIN_BYTES or more
+    app.config['COMPRESS'] = True
+    app.config['COMPRESS_MIN_BYTES'] = 1024
+    app.config['COMPRESS_LEVEL'] = 6
+    # worker threads of the ASGI mode (flaskr.asgi); None sizes them to the connection pool
+    app.config['ASGI_WORKERS'] = None
+    if test_config is not None:
+        app.config.update(test_config)
     CORS(app)
     cors = CORS(app, resources={r"/api/*": {"origins": "*"}})
-    setup_db(app)
+    setup_db(app, init=app.config['INIT_DB'])
+    # before instrument(), so the serialize timing wraps the fast encoder and the
+    # Server-Timing hook runs ahead of compression
+    setup_encoding(app)
+    metrics = instrument(app, db.get_engine(app))
+
+    question_count = CountCache(ttl=app.config['QUESTION_COUNT_TTL'])
+
+    def total_questions():
+        if not app.config['QUESTION_COUNT_CACHE']:
+            return count_rows(session, Question.id)
+        return question_count.get(lambda: count_rows(session, Question.id))
+
+    category_cache = CategoryCache(lambda: session.query(Category.id, Category.type).order_by(Category.id),
+                                   ttl=app.config['CATEGORY_CACHE_TTL'])
+    app.extensions['category_cache'] = category_cache
+    metrics.caches['category_cache'] = category_cache.stats
+
+    def categories_response(**fields):
+        # the categories are spliced in pre-serialized; If-None-Match gets a 304
+        entry = category_cache.entry()
+        body = '{"categories": ' + entry['fragment']
+        for key, value in fields.items():
+            body += ', ' + dumps(key) + ': ' + dumps(value)
+        body += '}'
+        response = app.response_class(body + '\n', mimetype='application/json')
+        response.set_etag(entry['etag'])
+        return response.make_conditional(request)
+
+    responses = ResponseCache(app, make_backend(app.config['RESPONSE_CACHE_URL'],
+                                                app.config['RESPONSE_CACHE_BYTES'],
+                                                app.config['RESPONSE_CACHE_TTL']),
+                              enabled=app.config['RESPONSE_CACHE'])
+    app.extensions['response_cache'] = responses
+    # read through responses.backend each time, so it follows the backend in use
+    question_version = VersionPoll(lambda: responses.backend.versions(['questions'])[0],
+                                   app.config['CACHE_SYNC_INTERVAL'])
+    app.extensions['question_version'] = question_version
+    metrics.caches['response_cache'] = responses.stats
+
+    flight = SingleFlight(app, enabled=app.config['COALESCE_REQUESTS'])
+    app.extensions['single_flight'] = flight
+    metrics.counters['coalesced_requests'] = ('Requests answered with the result of an identical request.',
+                                              lambda: flight.coalesced)
+
+    limiter = RateLimiter(app.config['RATE_LIMITS'])
+    app.extensions['rate_limiter'] = limiter
+    metrics.counters['throttled_requests'] = ('Requests refused by the rate limiter.',
+                                              lambda: limiter.stats()['throttled'])
+
+    @app.before_request
+    def throttle():
+        if not app.config['RATE_LIMIT']:
+            return None
+        header = app.config['RATE_LIMIT_CLIENT_HEADER']
+        client = request.headers.get(header, '').split(',')[0].strip() if header else ''
+        allowed, retry_after = limiter.allow(client or request.remote_addr, request.endpoint)
+        if allowed:
+            return None
+        response = flask.jsonify({"success": False, "message": "too many requests"})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(int(retry_after) + 1)
+        return response
+
+    def category_etag():
+        return category_cache.etag
+
+    quiz_index = QuestionIndex(lambda: session.query(Question.id, Question.category, Question.difficulty))
+    app.extensions['quiz_index'] = quiz_index
+    quiz_sessions = QuizSessionStore(ttl=app.config['QUIZ_SESSION_TTL'],
+                                     max_sessions=app.config['QUIZ_SESSION_MAX'],
+                                     max_ids=app.config['QUIZ_SESSION_MAX_IDS'])
+
+    question_search = make_search(session, Question, db.get_engine(app).dialect.name)
+    question_prefixes = PrefixIndex(lambda: session.query(Question.id, Question.question))
+    question_store = QuestionStore(lambda: session.query(Question.id, Question.question, Question.answer,
+                                                         Question.category, Question.difficulty))
+    app.extensions['question_store'] = question_store
+    use_store = app.config['QUESTION_STORE']
+
+    def get_question(qid):
+        if use_store:
+            return question_store.get(qid)
+        return session.query(Question).get(qid)
+
+    def id_list(limit):
+        # the JSON body's "ids", deduplicated in order; None if missing, malformed or longer than limit
+        p = request.get_json(silent=True)
+        ids = p.get("ids") if isinstance(p, dict) else None
+        if not isinstance(ids, list) or len(ids) > limit or any(json_int(i) is None for i in ids):
+            return None
+        return list(OrderedDict.fromkeys(ids))
+
+    question_stats = QuestionStats(
+        lambda: session.query(Question.category, Question.difficulty, func.count(Question.id))
+        .group_by(Question.category, Question.difficulty))
+    app.extensions['question_stats'] = question_stats
+
+    quiz_packs = PackCache(flight, max_packs=app.config['QUIZ_PACKS_MAX'])
+    app.extensions['quiz_packs'] = quiz_packs
+    metrics.caches['quiz_packs'] = quiz_packs.stats
+
+    def quiz_pack(category_id, seed, size, mix):
+        # category_id is the client's 0-based id or "all"; the pack is encoded once per key
+        category = None if category_id == "all" else int(category_id) + 1
+        if category is not None and category_cache.type_of(category) is None:
+            raise ValueError(category_id)
+
+        def build():
+            pools = quiz_index.pools(category) if mix else {None: quiz_index.ids(category)}
+            ids = build_pack(pools, size, seed, mix)
+            if use_store:
+                found = {qid: question_store.get(qid) for qid in ids}
+            else:
+                rows = session.query(Question.id, Question.question, Question.answer, Question.category,
+                                     Question.difficulty).filter(Question.id.in_(ids)) if ids else ()
+                found = {row[0]: QuestionRecord(*row) for row in rows}
+            # ids deleted outside this app are left out
+            records = [found[qid] for qid in ids if found.get(qid) is not None]
+            fields = {"category": category_id, "seed": seed, "size": len(records),
+                      "mix": {str(d): w for d, w in mix.items()} if mix else None, "success": True}
+            return make_entry(app, records_body(records, fields), 'application/json')
+
+        return quiz_packs.get(category, seed, size, mix, build)
+
+    def compact():
+        # ?compact=1 leaves out the fields a client already has from /api/v2.0/categories
+        return request.args.get('compact') in ('1', 'true')
+
+    def records_response(records, **fields):
+        return app.response_class(records_body(records, fields), mimetype='application/json')
+
+    def questions_changed():
+        # a bump of our own is not a reason to reload on the next poll
+        question_version.bumped(responses.invalidate('questions'))
+
+    def question_added(que):
+        question_count.invalidate()
+        questions_changed()
+        quiz_index.add(que.id, que.category, que.difficulty)
+        question_search.add(que.id, que.question, que.answer)
+        question_prefixes.add(que.id, que.question)
+        question_store.add(que)
+        question_stats.add(que.category, que.difficulty)
+        quiz_packs.invalidate(que.category)
+
+    def question_deleted(id, category, difficulty):
+        question_count.invalidate()
+        questions_changed()
+        quiz_index.remove(id)
+        question_search.remove(id)
+        question_prefixes.remove(id)
+        question_store.remove(id)
+        question_stats.remove(category, difficulty)
+        quiz_packs.invalidate(category)
+
+    def drop_question_caches():
+        question_count.invalidate()
+        quiz_index.invalidate()
+        question_search.invalidate()
+        question_prefixes.invalidate()
+        question_store.invalidate()
+        quiz_packs.clear()
+
+    def questions_reloaded():
+        # bulk loads do not return ids, so every index is rebuilt on next use
+        drop_question_caches()
+        questions_changed()
+
+    @app.before_request
+    def sync_caches():
+        # questions changed by another process: everything built from them is rebuilt on next use
+        if responses.backend.shared and question_version.changed():
+            drop_question_caches()
+            question_stats.invalidate()
+        elif question_table is not None and question_table.changed():
+            drop_question_caches()
+            question_stats.invalidate()
+
+    def questions_fingerprint():
+        try:
+            return tuple(session.query(func.count(Question.id), func.max(Question.id)).one())
+        finally:
+            session.remove()
+
+    question_table = (VersionPoll(questions_fingerprint, app.config['QUESTION_CACHE_TTL'])
+                      if app.config['QUESTION_CACHE_TTL'] is not None else None)
+    app.extensions['question_table'] = question_table
+
+    def best_scores(category, k):
+        query = session.query(Score.id, Score.player, Score.category, Score.score, Score.total)
+        if category is not None:
+            query = query.filter(Score.category == category)
+        return query.order_by(Score.score.desc(), Score.id).limit(k)
+
+    leaderboard = Leaderboard(best_scores, lambda: [c for c, in session.query(Score.category).distinct()],
+                              k=MAX_LEADERBOARD, ttl=app.config['LEADERBOARD_TTL'])
+    app.extensions['leaderboard'] = leaderboard
+
+    def write_scores(rows):
+        # games are ranked once committed, so a failed write never reaches the leaderboard
+        scores = [Score(**row) for row in rows]
+        session.add_all(scores)
+        session.flush()
+        ids = [s.id for s in scores]
+        session.commit()
+        return [leaderboard.add(id, row) for id, row in zip(ids, rows)]
+
+    score_writer = BatchWriter(app, write_scores)
+    app.extensions['score_writer'] = score_writer
+
+    def write_questions(rows):
+        # one transaction for the group; if it fails, each row is retried alone so only bad rows fail
+        ques = [Question(**row) for row in rows]
+        try:
+            session.add_all(ques)
+            session.flush()
+            records = [QuestionRecord(q.id, q.question, q.answer, q.category, q.difficulty) for q in ques]
+            session.commit()
+            results = records
+        except Exception:
+            session.rollback()
+            results = []
+            for row in rows:
+                q = Question(**row)
+                try:
+                    session.add(q)
+                    session.flush()
+                    record = QuestionRecord(q.id, q.question, q.answer, q.category, q.difficulty)
+                    session.commit()
+                    # appended only once committed, so each result lines up with its row
+                    results.append(record)
+                except Exception as e:
+                    session.rollback()
+                    results.append(e)
+        for r in results:
+            if not isinstance(r, Exception):
+                question_added(r)
+        return [r if isinstance(r, Exception) else r.id for r in results]
+
+    question_writer = BatchWriter(app, write_questions, max_batch=app.config['WRITE_BEHIND_BATCH'],
+                                  max_delay=app.config['WRITE_BEHIND_DELAY_MS'] / 1000.0,
+                                  max_queue=app.config['WRITE_BEHIND_QUEUE'])
+    app.extensions['question_writer'] = question_writer
+
+    def shutdown():
+        # writes what the writers still hold; atexit does it too, but not for os._exit
+        question_writer.close()
+        score_writer.close()
+
+    app.extensions['shutdown'] = shutdown
+
+    for name, writer in (('question_writer', question_writer), ('score_writer', score_writer)):
+        stats = writer.stats
+        metrics.gauges[name + '_queue_depth'] = ('Items waiting to be written.', lambda s=stats: s()['queued'])
+        metrics.gauges[name + '_last_flush_seconds'] = ('Duration of the last group write.',
+                                                        lambda s=stats: round(s()['last_flush_seconds'], 6))
+        metrics.counters[name + '_flush_seconds'] = ('Time spent writing groups.',
+                                                     lambda s=stats: round(s()['flush_seconds'], 6))
+        metrics.counters[name + '_batches'] = ('Groups written.', lambda s=stats: s()['batches'])
+        metrics.counters[name + '_rows'] = ('Items written.', lambda s=stats: s()['rows'])
+
+    def warm_caches():
+        # loads the in-memory caches now instead of on the first request; a no-op once loaded
+        if responses.backend.shared:
+            # the version they are loaded at, so the first poll does not drop them again
+            question_version.changed()
+        if question_table is not None:
+            question_table.changed()
+        category_cache.entry()
+        quiz_index.count()
+        total_questions()
+        leaderboard.top()
+        if use_store:
+            question_store.count()
+
+    app.extensions['warm_caches'] = warm_caches
+
+    def import_questions(stream, fmt):
+        rows = bulk.read_csv(stream) if fmt == 'csv' else bulk.read_ndjson(stream)
+        try:
+            # the stats are kept exact batch by batch instead of recounted
+            return bulk.import_rows(session, Question, rows,
+                                    lambda c: category_cache.type_of(c) is not None,
+                                    on_batch=question_stats.add_rows)
+        finally:
+            questions_reloaded()
+
+    @app.cli.command('init-db')
+    def init_db_command():
+        """Create the database, tables and search indexes if they are missing."""
+        init_db(app.config['SQLALCHEMY_DATABASE_URI'])
+        click.echo("database ready")
+
+    @app.cli.command('import-questions')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--format', 'fmt', type=click.Choice(['ndjson', 'csv']), default=None,
+                  help='Defaults to csv for .csv files, ndjson otherwise.')
+    def import_questions_command(path, fmt):
+        """Bulk load questions from an NDJSON or CSV file."""
+        fmt = fmt or ('csv' if path.endswith('.csv') else 'ndjson')
+        with open(path, encoding='utf-8', newline='') as f:
+            report = import_questions(f, fmt)
+        for i, b in enumerate(report['batches'], 1):
+            click.echo("batch {}: {} rows in {:.3f}s ({} rows/s)".format(i, b['rows'], b['seconds'], b['rows_per_sec']))
+        for e in report['errors']:
+            click.echo("row {}: {}".format(e['row'], e['error']), err=True)
+        click.echo("inserted {}, rejected {}".format(report['inserted'], report['rejected']))
+        failed = report['failed']
+        if failed is not None:
+            raise click.ClickException("batch {} failed at row {} ({}); the batches before it were committed"
+                                       .format(failed['batch'], failed['row'], failed['error']))
+
+    @app.cli.command('export-questions')
+    @click.argument('path', type=click.Path(dir_okay=False, writable=True))
+    @click.option('--format', 'fmt', type=click.Choice(['ndjson', 'csv']), default='ndjson')
+    def export_questions_command(path, fmt):
+        """Stream every question to an NDJSON or CSV file."""
+        encode = bulk.to_csv if fmt == 'csv' else bulk.to_ndjson
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            for chunk in encode(bulk.export_rows(session, Question)):
+                f.write(chunk)
+
+    @app.cli.command('quiz-pack')
+    @click.argument('path', type=click.Path(dir_okay=False, writable=True))
+    @click.option('--category', default='all', help='0-based category id, or "all".')
+    @click.option('--seed', required=True, help='Same seed and questions, same pack.')
+    @click.option('--size', type=click.IntRange(1, MAX_PACK_SIZE), default=QUESTIONS_PER_PAGE)
+    @click.option('--mix', default=None, help='Difficulty weights, e.g. 1:2,3:1.')
+    def quiz_pack_command(path, category, seed, size, mix):
+        """Write a shuffled quiz pack as JSON."""
+        try:
+            entry = quiz_pack(category, seed, size, parse_mix(mix))
+        except ValueError as e:
+            raise click.BadParameter(str(e))
+        with open(path, 'wb') as f:
+            f.write(entry['body'])
+        click.echo("{} bytes written to {}".format(len(entry['body']), path))
 
     """
     @TODO: Use the after_request decorator to set Access-Control-Allow
@@ -46,6 +485,17 @@ def create_app(test_config=None):
         # response.headers.add('Access-Control-Allow-Origin', '*')
         return data
 
+    @app.route("/ready", methods=['GET'])
+    def ready():
+        # readiness probe: 200 once the caches are loaded and the database answers
+        try:
+            warm_caches()
+            session.execute("SELECT 1")
+        except Exception:
+            session.rollback()
+            return flask.jsonify({"ready": False, "success": False}), 503
+        return flask.jsonify({"ready": True, "pid": os.getpid(), "success": True})
+
     """
     @TODO:
     Create an endpoint to handle GET requests
@@ -53,12 +503,9 @@ def create_app(test_config=None):
     """
 
     @app.route("/api/v2.0/categories", methods=['GET'])
+    @responses.cached(vary=category_etag)
     def submit_cat():
-        cat = session.query(Category)
-        cate = [c.type for c in cat]
-        response = flask.jsonify({'categories': cate,
-                                  "QUESTIONS_PER_PAGE": QUESTIONS_PER_PAGE})
-        return response
+        return categories_response(QUESTIONS_PER_PAGE=QUESTIONS_PER_PAGE)
 
     """
     @DONE:
@@ -74,30 +521,38 @@ def create_app(test_config=None):
     """
 
     @app.route("/api/v1.0/questions", methods=['GET', 'POST'])
+    @responses.cached('questions', vary=category_etag)
     def list_que():
-        all_que = session.query(Question)
-        cnt_que = len(list(all_que))
-
-        page = int(request.args.get('page'))
-        p = (page - 1) * QUESTIONS_PER_PAGE
+        after_id = request.args.get('after_id', type=int)
+        if use_store:
+            if after_id is not None:
+                que = question_store.after(after_id, QUESTIONS_PER_PAGE)
+            else:
+                page = request.args.get('page', 1, type=int)
+                que = question_store.page((page - 1) * QUESTIONS_PER_PAGE, QUESTIONS_PER_PAGE)
+            next_after_id = que[-1].id if len(que) == QUESTIONS_PER_PAGE else None
+            fields = {} if compact() else {'categories': category_cache.types,
+                                           'QUESTIONS_PER_PAGE': QUESTIONS_PER_PAGE}
+            return records_response(que, total_questions=question_store.count(), next_after_id=next_after_id,
+                                    success=True, **fields)
 
-        que = session.query(Question).offset(p).limit(QUESTIONS_PER_PAGE)
-        cat = session.query(Category)
+        cnt_que = total_questions()
+        if after_id is not None:
+            que = page_by_keyset(session.query(Question), Question.id, after_id, QUESTIONS_PER_PAGE)
+        else:
+            page = request.args.get('page', 1, type=int)
+            que = page_by_offset(session.query(Question), Question.id, page, QUESTIONS_PER_PAGE)
+        ques = [q.format() for q in que]
 
-        ques = [
-            {"id": q.id,
-             "question": q.question,
-             "category": q.category,
-             "answer": q.answer,
-             "difficulty": q.difficulty
-             } for q in que]
-        cate = [c.type for c in cat]
+        # next_after_id is the cursor for the following page, None once the end is reached
+        next_after_id = ques[-1]["id"] if len(ques) == QUESTIONS_PER_PAGE else None
 
         # response = flask.jsonify({"questions": [{"id": 1, "question": 'Ford', "category": 1, "answer": 'true',
         # "difficulty": 2}], 'categories': "categories" ... })
-        data = flask.jsonify({"questions": ques, 'categories': cate, "total_questions": cnt_que,
-                              "QUESTIONS_PER_PAGE": QUESTIONS_PER_PAGE, "success": True})
-        return data
+        data = {"questions": ques, "total_questions": cnt_que, "next_after_id": next_after_id, "success": True}
+        if not compact():
+            data.update({'categories': category_cache.types, "QUESTIONS_PER_PAGE": QUESTIONS_PER_PAGE})
+        return flask.jsonify(data)
         # return "user example"
 
     """
@@ -111,8 +566,12 @@ def create_app(test_config=None):
     @app.route("/api/v1.0/questions/<int:id>", methods=['DELETE'])
     def delete_que(id):
         try:
+            # the category and difficulty keep the stats exact
+            row = session.query(Question.category, Question.difficulty).filter(Question.id == id).first()
             session.query(Question).filter(Question.id == id).delete()
             session.commit()
+            if row is not None:
+                question_deleted(id, row.category, row.difficulty)
             data = flask.jsonify({"success": True, "deleted": id})
             return data
         except:
@@ -120,6 +579,44 @@ def create_app(test_config=None):
             data = flask.jsonify({"success": False})
             return data
 
+    @app.route("/api/v2.0/questions/batch", methods=['POST'])
+    def fetch_que_batch():
+        ids = id_list(MAX_BATCH_FETCH)
+        if ids is None:
+            return flask.jsonify({"success": False, "message": "bad request"})
+
+        if use_store:
+            found = {qid: question_store.get(qid) for qid in ids}
+        else:
+            found = {q.id: q for q in session.query(Question).filter(Question.id.in_(ids))} if ids else {}
+        ques = [found[qid].format() for qid in ids if found.get(qid) is not None]
+        missing = [qid for qid in ids if found.get(qid) is None]
+        data = flask.jsonify({"questions": ques, "missing": missing, "success": True})
+        return data
+
+    @app.route("/api/v2.0/questions/batch", methods=['DELETE'])
+    def delete_que_batch():
+        ids = id_list(MAX_BATCH_DELETE)
+        if ids is None:
+            return flask.jsonify({"success": False, "message": "bad request"})
+
+        try:
+            rows = session.query(Question.id, Question.category, Question.difficulty).filter(Question.id.in_(ids))
+            existing = {qid: (category, difficulty) for qid, category, difficulty in rows} if ids else {}
+            if existing:
+                session.query(Question).filter(Question.id.in_(existing)).delete(synchronize_session=False)
+            session.commit()
+        except:
+            session.rollback()
+            data = flask.jsonify({"success": False})
+            return data
+
+        for qid, (category, difficulty) in existing.items():
+            question_deleted(qid, category, difficulty)
+        results = [{"id": qid, "deleted": qid in existing} for qid in ids]
+        data = flask.jsonify({"results": results, "deleted": len(existing), "success": True})
+        return data
+
     """
     @DONE:
     Create an endpoint to POST a new question,
@@ -131,14 +628,47 @@ def create_app(test_config=None):
     of the questions list in the "List" tab.
     """
 
+    def write_timed_out(future):
+        if future.cancel():
+            # still queued, so it will never be written and the client can retry
+            return flask.jsonify({"success": False, "message": "timed out"})
+        # its group is being written and may still commit: a retry could duplicate it
+        data = flask.jsonify({"success": True, "pending": True})
+        data.status_code = 202
+        return data
+
     @app.route("/api/v2.0/questions", methods=['POST'])
     def submit_que():
         if request.method == 'POST':
             sc = flask.request.json
+            if app.config['WRITE_BEHIND']:
+                try:
+                    que = Question(**sc)
+                    if category_cache.type_of(que.category) is None:
+                        raise ValueError(que.category)
+                    row = {"question": que.question, "answer": que.answer, "category": que.category,
+                           "difficulty": que.difficulty}
+                    future = question_writer.submit(row)
+                except:
+                    data = flask.jsonify({"success": False})
+                    return data
+                try:
+                    # the future resolves once the group holding this row is committed
+                    created = future.result(app.config['WRITE_BEHIND_TIMEOUT'])
+                except concurrent.futures.TimeoutError:
+                    return write_timed_out(future)
+                except Exception:
+                    return flask.jsonify({"success": False})
+                data = {"success": True, "created": created}
+                if not compact():
+                    data['categories'] = category_cache.types
+                return flask.jsonify(data)
+
             try:
                 que = Question(**sc)
                 session.add(que)
                 session.commit()
+                question_added(que)
                 #data = flask.jsonify({"success": True, "created": que.id})
                 #return data
 
@@ -148,10 +678,33 @@ def create_app(test_config=None):
                 return data
 
             else:
-                cat = session.query(Category)
-                cate = [c.type for c in cat]
-                data = flask.jsonify({'categories': cate, "success": True, "created": que.id})
-                return data
+                data = {"success": True, "created": que.id}
+                if not compact():
+                    data['categories'] = category_cache.types
+                return flask.jsonify(data)
+
+    @app.route("/api/v2.0/questions/bulk", methods=['POST'])
+    def bulk_submit_que():
+        # text/csv bodies need a header line; anything else is read as one JSON object per line
+        fmt = 'csv' if request.mimetype == 'text/csv' else 'ndjson'
+        stream = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
+        try:
+            report = import_questions(stream, fmt)
+        except Exception:
+            return flask.jsonify({"success": False, "message": "unprocessable"})
+        # batches committed before a failure stay, so the report is returned either way
+        report["success"] = report["failed"] is None
+        if report["failed"] is not None:
+            report["message"] = "unprocessable"
+        return flask.jsonify(report)
+
+    @app.route("/api/v2.0/questions/export", methods=['GET'])
+    def export_que():
+        if request.args.get('format') == 'csv':
+            body, mimetype = bulk.to_csv(bulk.export_rows(session, Question)), 'text/csv'
+        else:
+            body, mimetype = bulk.to_ndjson(bulk.export_rows(session, Question)), 'application/x-ndjson'
+        return app.response_class(stream_with_context(body), mimetype=mimetype)
 
     """
     @DONE:
@@ -165,19 +718,36 @@ def create_app(test_config=None):
     """
 
     @app.route("/api/v3.0/questions", methods=['POST'])
+    @responses.cached('questions')
+    @flight.coalesce()
     def search_by_que():
         if request.method == 'POST':
-            search_term = flask.request.json["searchTerm"]
-            que = session.query(Question).filter(Question.question.ilike('%' + search_term + '%'))
-            cnt_que = len(list(que))
+            body = flask.request.json
+            search_term = body["searchTerm"]
+            search_answers = bool(body.get("searchAnswers", False))
+            page = body.get("page")
+            if page is not None and (json_int(page) is None or page < 1):
+                return flask.jsonify({"success": False, "message": "bad request"})
+
+            mode = stream_mode(request)
+            if mode is not None and page is None:
+                def tail(cnt_que):
+                    if cnt_que >= 1:
+                        return {"total_questions": cnt_que, "current_category": "", "success": True}
+                    return {"total_questions": 0, "success": False, "message": "resource not found"}
+
+                que = question_search.iter_search(search_term, search_answers)
+                return streamed_response(app, mode, que, tail)
+
+            if page is None:
+                que = question_search.search(search_term, search_answers)
+                cnt_que = len(que)
+            else:
+                p = (page - 1) * QUESTIONS_PER_PAGE
+                cnt_que = question_search.count(search_term, search_answers)
+                que = question_search.search(search_term, search_answers, p, QUESTIONS_PER_PAGE)
             if cnt_que >= 1:
-                ques = [
-                    {"id": q.id,
-                     "question": q.question,
-                     "category": q.category,
-                     "answer": q.answer,
-                     "difficulty": q.difficulty
-                     } for q in que]
+                ques = [q.format() for q in que]
 
                 data = flask.jsonify({"questions": ques, "total_questions": cnt_que,
                                           "current_category": "", "success": True})
@@ -186,6 +756,15 @@ def create_app(test_config=None):
                 data = flask.jsonify({"success": False, "message": "resource not found"})
                 return data
 
+    @app.route("/api/v3.0/questions/autocomplete", methods=['GET'])
+    def autocomplete_que():
+        prefix = request.args.get('q', '')
+        limit = min(request.args.get('limit', 10, type=int), MAX_SUGGESTIONS)
+        suggestions = [{"id": qid, "question": text}
+                       for qid, text in question_prefixes.suggest(prefix, limit)]
+        data = flask.jsonify({"suggestions": suggestions, "success": True})
+        return data
+
     """
     @DONE:
     Create a GET endpoint to get questions based on category.
@@ -196,27 +775,31 @@ def create_app(test_config=None):
     """
 
     @app.route("/api/v1.0/categories/<int:cat>/questions", methods=['GET'])
+    @responses.cached('questions', vary=category_etag)
+    @flight.coalesce()
     def search_by_cate(cat):
-        que = session.query(Question).filter(Question.category == str(cat + 1))
+        que = session.query(Question).filter(Question.category == cat + 1).order_by(Question.id)
         #cate = session.query(Category).filter_by(id=cat+1).first().type
         #cate = session.query(Category).filter(Category.id == cat).first().type
 
-        c = session.query(Category).filter_by(id=cat+1).one_or_none()
-        if c is not None:
-            category = c.type
-        else:
+        category = category_cache.type_of(cat + 1)
+        if category is None:
             data = flask.jsonify({"success": False, "message": "bad request"})
             return data
 
-        cnt_que = len(list(que))
+        mode = stream_mode(request)
+        if mode is not None:
+            def tail(cnt_que):
+                return {"total_questions": cnt_que, "current_category": category, "success": True}
+
+            return streamed_response(app, mode, stream_rows(que), tail)
 
-        ques = [
-            {"id": q.id,
-             "question": q.question,
-             "category": q.category,
-             "answer": q.answer,
-             "difficulty": q.difficulty
-             } for q in que]
+        if use_store:
+            que = question_store.category(cat + 1)
+            return records_response(que, total_questions=len(que), current_category=category, success=True)
+
+        ques = [q.format() for q in que]
+        cnt_que = len(ques)
 
         data = flask.jsonify({"questions": ques, "total_questions": cnt_que,
                                   "current_category": category, "success": True})
@@ -234,12 +817,19 @@ def create_app(test_config=None):
     and shown whether they were correct or not.
     """
 
+    @app.route("/api/v1.1/stats", methods=['GET'])
+    def question_stats_summary():
+        # ?recompute=1 recounts from the table, otherwise the running counts are returned
+        if request.args.get('recompute') in ('1', 'true'):
+            question_stats.recompute()
+        summary = question_stats.summary(category_cache.entry()['by_id'])
+        summary["success"] = True
+        return flask.jsonify(summary)
+
     @app.route("/api/v1.1/categories", methods=['GET'])
+    @responses.cached(vary=category_etag)
     def quiz():
-        cat = session.query(Category)
-        cate = [c.type for c in cat]
-        data = flask.jsonify({"categories": cate, "success": True})
-        return data
+        return categories_response(success=True)
 
     @app.route("/api/v1.1/quizzes", methods=['POST'])
     def quizzes():
@@ -251,32 +841,194 @@ def create_app(test_config=None):
             p_c_id = p["quiz_category"]["id"]
 
             if p_c_id == "all":
-                que = session.query(Question)
+                p_c = None
             else:
                 p_c = int(p_c_id) + 1
-                que = session.query(Question).filter(Question.category == str(p_c))
-                #for q in que:
-                    #print(q.id)
-            #print(p)
-
-            ques = [
-                {"id": q.id,
-                 "question": q.question,
-                 "category": q.category,
-                 "answer": q.answer,
-                 "difficulty": q.difficulty
-                 } for q in que]
-            try:
-                dr = random.choice(list(filter(lambda d: d['id'] not in p_que, ques)))
+
+            # adaptive play: a target difficulty, or the share of answers right so far
+            level = p.get("difficulty")
+            if level is not None:
+                level = int(level)
+            elif p.get("score") is not None:
+                level = difficulty_for(p["score"])
+
+            # draw an unseen id from the in-memory index, then load just that row
+            q = None
+            qid = quiz_index.pick(p_c, p_que, level)
+            while qid is not None and q is None:
+                q = get_question(qid)
+                if q is None:
+                    # deleted outside this app, drop it and draw again
+                    quiz_index.remove(qid)
+                    qid = quiz_index.pick(p_c, p_que, level)
+
+            if q is not None:
+                dr = q.format()
                 data = flask.jsonify({"question": dr, "total_que_answered": q_p_p, "questionsPerPlay": q_p_p, "success": True
                                           })
                 return data
-            except:
-                data = flask.jsonify({"total_que_answered": len(ques), "success": True})
+            else:
+                data = flask.jsonify({"total_que_answered": quiz_index.count(p_c), "success": True})
+                return data
+        except:
+            return flask.jsonify({"success": False, "message": "bad request"})
+
+    """
+    Quiz packs: a whole game in one download, the same for every player given
+    the same seed, so a large event serves one precomputed body.
+    """
+
+    @app.route("/api/v1.1/quizzes/packs", methods=['GET'])
+    def quiz_packs_endpoint():
+        try:
+            category_id = request.args.get("category", "all")
+            seed = request.args["seed"]
+            size = int(request.args.get("size", QUESTIONS_PER_PAGE))
+            mix = parse_mix(request.args.get("mix"))
+            if not 0 < size <= MAX_PACK_SIZE:
+                raise ValueError(size)
+            entry = quiz_pack(category_id, seed, size, mix)
+        except:
+            return flask.jsonify({"success": False, "message": "bad request"})
+        return entry_response(app, entry)
+
+    """
+    Quiz sessions: the server remembers which questions each game has served
+    and draws the next one on demand, so each turn only sends the session token instead of previous_questions.
+    """
+
+    @app.route("/api/v1.1/quizzes/sessions", methods=['POST'])
+    def start_quiz():
+        try:
+            p = flask.request.json
+
+            q_p_p = p.get("questionsPerPlay")
+            p_c_id = p["quiz_category"]["id"]
+
+            if p_c_id == "all":
+                p_c = None
+            else:
+                p_c = int(p_c_id) + 1
+            if q_p_p is not None:
+                q_p_p = int(q_p_p)
+            adaptive = bool(p.get("adaptive", False))
+            level = int(p.get("difficulty", DEFAULT_DIFFICULTY))
+        except:
+            return flask.jsonify({"success": False, "message": "bad request"})
+
+        if adaptive:
+            levels = quiz_index.levels(p_c)
+            token = quiz_sessions.start_adaptive(p_c, levels, q_p_p, level)
+            data = flask.jsonify({"token": token, "total_questions": sum(levels.values()),
+                                  "questionsPerPlay": q_p_p, "difficulty": level, "success": True})
+            return data
+
+        token = quiz_sessions.start(p_c, q_p_p)
+        data = flask.jsonify({"token": token, "total_questions": quiz_index.count(p_c),
+                              "questionsPerPlay": q_p_p, "success": True})
+        return data
+
+    @app.route("/api/v1.1/quizzes/sessions/<token>", methods=['POST'])
+    def next_quiz_question(token):
+        quiz = quiz_sessions.get(token)
+        if quiz is None:
+            return flask.jsonify({"success": False, "message": "resource not found"})
+
+        # adaptive sessions are told whether the previous question was answered right
+        p = request.get_json(silent=True) or {}
+        adaptive = isinstance(quiz, AdaptiveQuizSession)
+        # concurrent turns of one session would draw against the same seen ids
+        with quiz.lock:
+            if adaptive and p.get("correct") is not None:
+                quiz.record(p["correct"])
+
+            q = None
+            qid = quiz.next_id(quiz_index)
+            while qid is not None and q is None:
+                quiz_sessions.served(quiz, qid)
+                # ids deleted after the index was loaded are skipped
+                q = get_question(qid)
+                if q is None:
+                    qid = quiz.next_id(quiz_index)
+
+            if q is None:
+                data = flask.jsonify({"total_que_answered": quiz.answered, "success": True})
                 return data
+
+            quiz.answered += 1
+            result = {"question": q.format(), "total_que_answered": quiz.answered,
+                      "questionsPerPlay": quiz.questions_per_play, "success": True}
+            if adaptive:
+                result["difficulty"] = quiz.difficulty
+        data = flask.jsonify(result)
+        return data
+
+    @app.route("/api/v1.1/quizzes/sessions/<token>", methods=['DELETE'])
+    def end_quiz(token):
+        if quiz_sessions.end(token):
+            return flask.jsonify({"success": True, "deleted": token})
+        return flask.jsonify({"success": False, "message": "resource not found"})
+
+    """
+    Leaderboards: finished games are written to the scores table in batches
+    by a background writer and ranked in memory once committed.
+    """
+
+    @app.route("/api/v1.1/scores", methods=['POST'])
+    def submit_score():
+        try:
+            p = flask.request.json
+
+            player = p["player"].strip()
+            score = int(p["score"])
+            total = p.get("total")
+            p_c_id = p.get("quiz_category", {}).get("id", "all")
+
+            if p_c_id == "all":
+                p_c = None
+            else:
+                p_c = int(p_c_id) + 1
+            if total is not None:
+                total = int(total)
+            if not player or len(player) > 64 or score < 0:
+                raise ValueError(player)
+            if p_c is not None and category_cache.type_of(p_c) is None:
+                raise ValueError(p_c)
         except:
             return flask.jsonify({"success": False, "message": "bad request"})
 
+        entry = {"player": player, "category": p_c, "score": score, "total": total}
+        try:
+            future = score_writer.submit(entry)
+        except queue.Full:
+            # the writer is too far behind to take the game
+            return flask.jsonify({"success": False})
+        try:
+            rank, category_rank = future.result(app.config['SCORE_WRITE_TIMEOUT'])
+        except concurrent.futures.TimeoutError:
+            return write_timed_out(future)
+        except Exception:
+            return flask.jsonify({"success": False})
+        data = flask.jsonify({"rank": rank, "category_rank": category_rank, "success": True})
+        return data
+
+    @app.route("/api/v1.1/leaderboard", methods=['GET'])
+    def global_leaderboard():
+        limit = min(request.args.get('limit', 10, type=int), MAX_LEADERBOARD)
+        data = flask.jsonify({"scores": leaderboard.top(None, limit), "success": True})
+        return data
+
+    @app.route("/api/v1.1/categories/<int:cat>/leaderboard", methods=['GET'])
+    def category_leaderboard(cat):
+        category = category_cache.type_of(cat + 1)
+        if category is None:
+            data = flask.jsonify({"success": False, "message": "bad request"})
+            return data
+        limit = min(request.args.get('limit', 10, type=int), MAX_LEADERBOARD)
+        data = flask.jsonify({"scores": leaderboard.top(cat + 1, limit), "current_category": category,
+                              "success": True})
+        return data
+
     """
     @TODO:
     Create error handlers for all expected errors
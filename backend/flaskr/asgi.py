@@ -0,0 +1,149 @@
+import asyncio
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from flaskr import create_app
+from models import db
+from settings import DB_POOL_SIZE, DB_MAX_OVERFLOW
+
+# request bodies larger than this are spooled to a temporary file
+MAX_MEMORY_BODY = 1024 * 1024
+
+"""
+ASGI serving mode
+
+create_asgi_app() wraps the app from create_app() so it runs under an
+ASGI server with the same routes and JSON contracts:
+
+    uvicorn --factory flaskr.asgi:create_asgi_app --workers 1
+
+Connections, request bodies and response bodies are handled on the event
+loop, so idle keep-alive connections and slow clients cost no threads.
+A view runs on a worker thread only while it executes; the worker count
+defaults to the engine's pool size plus overflow, so requests beyond what
+the database can serve wait on the event loop instead of in the pool.
+
+The views stay synchronous: Flask 1.0 and SQLAlchemy 1.3 have no asyncio
+support, so an async driver (asyncpg, aiosqlite) cannot be used until
+both are upgraded.
+"""
+
+
+def build_environ(scope, body):
+    """The WSGI environ for an ASGI http scope."""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        # the body is read in full first, so it can be read to EOF even without a Content-Length
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        if name in environ:
+            value = environ[name] + ',' + value
+        environ[name] = value
+    return environ
+
+
+async def read_body(receive):
+    body = tempfile.SpooledTemporaryFile(max_size=MAX_MEMORY_BODY)
+    more = True
+    while more:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        body.write(message.get('body', b''))
+        more = message.get('more_body', False)
+    body.seek(0)
+    return body
+
+
+class ASGIApp:
+
+    def __init__(self, app, max_workers):
+        self.app = app
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='asgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            body = await read_body(receive)
+            loop = asyncio.get_running_loop()
+            try:
+                await loop.run_in_executor(self.executor, self.run, build_environ(scope, body), send, loop)
+            finally:
+                body.close()
+        else:
+            raise NotImplementedError("unsupported ASGI scope type " + scope['type'])
+
+    def run(self, environ, send, loop):
+        """
+        Runs the WSGI app on a worker thread. The whole response is iterated
+        on this thread (streamed views keep their request context there) and
+        each chunk is handed to the event loop, waiting while the client
+        catches up.
+        """
+        state = {}
+
+        def forward(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        def start_response(status, headers, exc_info=None):
+            state['status'] = int(status.split(' ', 1)[0])
+            state['headers'] = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+
+        def start():
+            if not state.get('started'):
+                state['started'] = True
+                forward({'type': 'http.response.start', 'status': state['status'],
+                         'headers': state['headers']})
+
+        result = self.app.wsgi_app(environ, start_response)
+        try:
+            for chunk in result:
+                if chunk:
+                    start()
+                    forward({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            start()
+            forward({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=True)
+                self.app.extensions['shutdown']()
+                db.get_engine(self.app).dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+def create_asgi_app(test_config=None, max_workers=None):
+    app = create_app(test_config)
+    return ASGIApp(app, max_workers or app.config.get('ASGI_WORKERS') or DB_POOL_SIZE + DB_MAX_OVERFLOW)
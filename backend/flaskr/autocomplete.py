@@ -0,0 +1,110 @@
+import bisect
+import re
+import threading
+
+# index keys are cut to this many characters; longer prefixes are checked against the full text
+KEY_LENGTH = 32
+
+WORD_START = re.compile(r'\b\w')
+
+"""
+PrefixIndex
+    search-as-you-type over question text. Two sorted arrays of
+    (key, question id) pairs are kept: one keyed on the start of each
+    question, one on the text from the start of every other word. A prefix
+    lookup is a bisect into each array followed by a walk that stops after
+    `limit` distinct questions, so its cost does not depend on the number
+    of questions. Matches at the start of a question come first.
+"""
+
+
+class PrefixIndex:
+
+    def __init__(self, loader):
+        # loader returns (id, question) rows
+        self.loader = loader
+        self._starts = None
+        self._words = None
+        self._texts = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _keys(text):
+        text = (text or '').lower()
+        offsets = [m.start() for m in WORD_START.finditer(text)]
+        start = text[:KEY_LENGTH]
+        words = [text[i:i + KEY_LENGTH] for i in offsets if i > 0]
+        return start, words
+
+    def _add(self, qid, text, insort):
+        start, words = self._keys(text)
+        self._texts[qid] = text or ''
+        insort(self._starts, (start, qid))
+        for key in words:
+            insort(self._words, (key, qid))
+
+    def _ensure_loaded(self):
+        if self._starts is None:
+            self._starts, self._words, self._texts = [], [], {}
+            # appending then sorting once is much faster than insort per row
+            for qid, text in self.loader():
+                self._add(qid, text, list.append)
+            self._starts.sort()
+            self._words.sort()
+
+    @staticmethod
+    def _discard(entries, entry):
+        i = bisect.bisect_left(entries, entry)
+        if i < len(entries) and entries[i] == entry:
+            del entries[i]
+
+    def add(self, qid, text):
+        with self._lock:
+            if self._starts is not None:
+                self._add(qid, text, bisect.insort)
+
+    def remove(self, qid):
+        with self._lock:
+            if self._starts is None:
+                return
+            text = self._texts.pop(qid, None)
+            if text is None:
+                return
+            start, words = self._keys(text)
+            self._discard(self._starts, (start, qid))
+            for key in words:
+                self._discard(self._words, (key, qid))
+
+    def invalidate(self):
+        with self._lock:
+            self._starts = None
+
+    def _walk(self, entries, prefix, key, found, limit):
+        i = bisect.bisect_left(entries, (key,))
+        while i < len(entries) and len(found) < limit:
+            entry, qid = entries[i]
+            if not entry.startswith(key):
+                break
+            # keys are truncated, so long prefixes are confirmed on the full text
+            if qid not in found and (len(prefix) <= KEY_LENGTH or prefix in self._texts[qid].lower()):
+                found.append(qid)
+            i += 1
+
+    def complete(self, prefix, limit=10):
+        """Ids of at most limit questions with a word starting with prefix."""
+        prefix = prefix.lower().lstrip()
+        if not prefix:
+            return []
+        key = prefix[:KEY_LENGTH]
+        found = []
+        with self._lock:
+            self._ensure_loaded()
+            self._walk(self._starts, prefix, key, found, limit)
+            self._walk(self._words, prefix, key, found, limit)
+        return found
+
+    def suggest(self, prefix, limit=10):
+        """(id, question) pairs for complete(), read from the index without a query."""
+        ids = self.complete(prefix, limit)
+        texts = self._texts
+        return [(qid, texts[qid]) for qid in ids if qid in texts]
@@ -0,0 +1,161 @@
+import csv
+import io
+import json
+import logging
+import time
+
+from flaskr.encoding import dumps
+
+FIELDS = ('question', 'answer', 'category', 'difficulty')
+BATCH_SIZE = 1000
+# rejected rows listed in a report; the count covers all of them
+MAX_REPORTED_ERRORS = 100
+
+log = logging.getLogger(__name__)
+
+"""
+Bulk question import/export
+
+Rows are read from an NDJSON or CSV stream one at a time, validated against
+the Question fields and inserted in batches of BATCH_SIZE, each committed on
+its own: with PostgreSQL COPY, otherwise with bulk_insert_mappings. If a
+batch cannot be written (or the stream cannot be read) the import stops
+there; the batches committed before it stay, and the report says so. The
+export streams rows back from a server-side cursor.
+"""
+
+
+class RowError(ValueError):
+    pass
+
+
+def read_ndjson(stream):
+    for line in stream:
+        line = line.strip()
+        if line:
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                # reported for this row, the rest of the stream is still read
+                yield RowError("invalid JSON: {}".format(e))
+
+
+def read_csv(stream):
+    # the first line names the columns
+    for row in csv.DictReader(stream):
+        yield row
+
+
+def validate(row, known_category):
+    """Returns the row as a dict of the Question fields, or raises RowError."""
+    if not isinstance(row, dict):
+        raise RowError("expected an object with " + ", ".join(FIELDS))
+    missing = [f for f in FIELDS if row.get(f) in (None, '')]
+    if missing:
+        raise RowError("missing " + ", ".join(missing))
+    question = str(row['question']).strip()
+    answer = str(row['answer']).strip()
+    if not question or not answer:
+        raise RowError("question and answer must not be blank")
+    try:
+        category = int(row['category'])
+        difficulty = int(row['difficulty'])
+    except (TypeError, ValueError):
+        raise RowError("category and difficulty must be integers")
+    if not known_category(category):
+        raise RowError("unknown category {}".format(category))
+    if not 1 <= difficulty <= 5:
+        raise RowError("difficulty must be between 1 and 5")
+    return {'question': question, 'answer': answer, 'category': category, 'difficulty': difficulty}
+
+
+def copy_rows(session, rows):
+    """Inserts rows with COPY ... FROM STDIN on the session's connection."""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for row in rows:
+        writer.writerow([row[f] for f in FIELDS])
+    buf.seek(0)
+    cursor = session.connection().connection.cursor()
+    try:
+        cursor.copy_expert("COPY questions (question, answer, category, difficulty) FROM STDIN WITH CSV", buf)
+    finally:
+        cursor.close()
+
+
+def insert_rows(session, model, rows):
+    if session.get_bind().dialect.name == 'postgresql':
+        copy_rows(session, rows)
+    else:
+        session.bulk_insert_mappings(model, rows)
+
+
+def import_rows(session, model, rows, known_category, batch_size=BATCH_SIZE, on_batch=None):
+    """
+    Validates and inserts rows, committing every batch_size valid rows;
+    on_batch(rows) is called with each committed batch. Returns a report
+    with the inserted and rejected counts, the first rejected rows (1-based
+    row numbers) and per-batch throughput; "failed" is None, or the batch
+    number, last row read and error type where the import stopped.
+    """
+    report = {"inserted": 0, "rejected": 0, "errors": [], "batches": [], "failed": None}
+    batch = []
+
+    def flush():
+        started = time.perf_counter()
+        insert_rows(session, model, batch)
+        session.commit()
+        seconds = time.perf_counter() - started
+        if on_batch is not None:
+            on_batch(batch)
+        report["inserted"] += len(batch)
+        report["batches"].append({"rows": len(batch), "seconds": round(seconds, 6),
+                                  "rows_per_sec": round(len(batch) / seconds) if seconds else None})
+        del batch[:]
+
+    number = 0
+    try:
+        for number, row in enumerate(rows, 1):
+            try:
+                if isinstance(row, RowError):
+                    raise row
+                batch.append(validate(row, known_category))
+            except RowError as e:
+                report["rejected"] += 1
+                if len(report["errors"]) < MAX_REPORTED_ERRORS:
+                    report["errors"].append({"row": number, "error": str(e)})
+                continue
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+    except Exception as e:
+        log.exception("import stopped at row %d", number)
+        session.rollback()
+        report["failed"] = {"batch": len(report["batches"]) + 1, "row": number, "error": type(e).__name__}
+    return report
+
+
+def export_rows(session, model, batch_size=BATCH_SIZE):
+    """Yields question dicts from a server-side cursor, batch_size rows at a time."""
+    query = session.query(model).order_by(model.id) \
+        .execution_options(stream_results=True).yield_per(batch_size)
+    for q in query:
+        yield q.format()
+
+
+def to_ndjson(rows):
+    for row in rows:
+        yield dumps(row) + '\n'
+
+
+def to_csv(rows):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    columns = ('id',) + FIELDS
+    yield ','.join(columns) + '\r\n'
+    for row in rows:
+        writer.writerow([row[c] for c in columns])
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
@@ -0,0 +1,68 @@
+import hashlib
+import threading
+import time
+
+from flaskr.encoding import dumps
+
+"""
+CategoryCache
+    the categories table, loaded once and shared by every endpoint.
+    Keeps the list of types, an id -> type map, the types pre-serialized
+    as a JSON fragment and an ETag for that fragment.
+"""
+
+
+class CategoryCache:
+
+    def __init__(self, loader, ttl=None):
+        # loader returns (id, type) rows ordered by id
+        self.loader = loader
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entry = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def entry(self):
+        """The current cache entry: types, by_id, fragment and etag."""
+        with self._lock:
+            expired = self.ttl is not None and time.monotonic() - self._loaded_at > self.ttl
+            if self._entry is None or expired:
+                self.misses += 1
+                rows = list(self.loader())
+                types = [t for _, t in rows]
+                fragment = dumps(types)
+                self._entry = {
+                    'types': types,
+                    'by_id': dict(rows),
+                    'fragment': fragment,
+                    'etag': hashlib.sha1(fragment.encode('utf-8')).hexdigest(),
+                }
+                self._loaded_at = time.monotonic()
+            else:
+                self.hits += 1
+            return self._entry
+
+    @property
+    def types(self):
+        return self.entry()['types']
+
+    @property
+    def fragment(self):
+        return self.entry()['fragment']
+
+    @property
+    def etag(self):
+        return self.entry()['etag']
+
+    def type_of(self, id):
+        """The type of category id, or None if there is no such category."""
+        return self.entry()['by_id'].get(id)
+
+    def invalidate(self):
+        with self._lock:
+            self._entry = None
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
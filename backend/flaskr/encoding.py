@@ -0,0 +1,127 @@
+import gzip
+import json
+
+try:
+    import orjson
+except ImportError:  # optional: pip install orjson
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # optional: pip install brotli
+    brotli = None
+
+from flask import request
+
+COMPRESSIBLE = ('application/json', 'application/x-ndjson', 'text/plain', 'text/csv')
+
+"""
+Response encoding
+
+dumps(obj) is the one JSON serializer: orjson when it is installed (and
+fast_json is left on), the standard library otherwise. Either way the
+output is compact, key-sorted and ASCII-only, as flask.jsonify writes it
+with JSON_AS_ASCII. orjson cannot escape non-ASCII text, so output that
+has any is encoded again by the standard library. Strings, integers and
+the structure come out byte for byte the same. Floats may not: orjson
+writes 1e-05 as 0.00001 and 1e+16 as 1e16, which parse to the same
+values. flask.jsonify goes through dumps() too.
+
+setup_encoding(app) compresses responses of COMPRESS_MIN_BYTES or more
+with brotli or gzip, whichever the client accepts (brotli needs the
+brotli package). Cached responses keep their compressed bodies (see
+compress_variants), so a hit is not compressed again.
+"""
+
+# switched off by the encoding benchmark to compare with the standard library
+fast_json = orjson is not None
+
+
+def fast_dumps(obj, ensure_ascii=True):
+    """orjson's encoding of obj, or None when orjson is off, cannot encode obj or would not escape non-ASCII text."""
+    if not fast_json:
+        return None
+    try:
+        encoded = orjson.dumps(obj, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    except TypeError:
+        # types orjson does not know (Decimal, custom classes) take the standard path
+        return None
+    if ensure_ascii and not encoded.isascii():
+        return None
+    return encoded
+
+
+def dumps(obj):
+    encoded = fast_dumps(obj)
+    if encoded is None:
+        encoded = json.dumps(obj, sort_keys=True, separators=(',', ':'))
+    return encoded
+
+
+def fast_encoder(base):
+    """A JSON encoder class for flask.jsonify that serializes through dumps()."""
+
+    class FastJSONEncoder(base):
+        def encode(self, o):
+            # pretty-printed output (JSONIFY_PRETTYPRINT_REGULAR, debug mode) keeps the standard encoder
+            encoded = fast_dumps(o, self.ensure_ascii) if self.indent is None else None
+            if encoded is None:
+                encoded = super(FastJSONEncoder, self).encode(o)
+            return encoded
+
+    return FastJSONEncoder
+
+
+def encodings():
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def negotiate(accept_encoding):
+    """The best encoding the client accepts, or None."""
+    for encoding in encodings():
+        if accept_encoding[encoding]:
+            return encoding
+    return None
+
+
+def compress(body, encoding, level=6):
+    if encoding == 'br':
+        return brotli.compress(body, quality=min(level, 11))
+    return gzip.compress(body, compresslevel=level)
+
+
+def compress_variants(body, min_bytes, level=6):
+    """encoding -> compressed body, for every supported encoding (empty below min_bytes)."""
+    if len(body) < min_bytes:
+        return {}
+    return {encoding: compress(body, encoding, level) for encoding in encodings()}
+
+
+def use_encoding(response, encoding, body):
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        # the compressed body is a different representation of the same resource
+        response.set_etag(etag, weak=True)
+
+
+def setup_encoding(app):
+    app.json_encoder = fast_encoder(app.json_encoder)
+
+    @app.after_request
+    def compress_response(response):
+        if (not app.config['COMPRESS'] or response.status_code != 200 or response.direct_passthrough
+                or response.is_streamed or 'Content-Encoding' in response.headers
+                or response.mimetype not in COMPRESSIBLE):
+            return response
+        body = response.get_data()
+        if len(body) < app.config['COMPRESS_MIN_BYTES']:
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = negotiate(request.accept_encodings)
+        if encoding is None:
+            return response
+        use_encoding(response, encoding, compress(body, encoding, app.config['COMPRESS_LEVEL']))
+        return response
@@ -0,0 +1,197 @@
+import cProfile
+import io
+import pstats
+import threading
+import time
+
+from flask import g, has_app_context, request
+from sqlalchemy import event
+
+# upper bounds (seconds) of the request duration histogram
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+PROFILE_LINES = 40
+
+"""
+Request instrumentation
+
+Every request records, per endpoint:
+  db         time spent executing SQL (cursor execute events)
+  queries    statements executed
+  rows       rows reported by the cursors
+  serialize  time spent encoding JSON in flask.jsonify
+  total      time from before_request to after_request
+They are sent back in a Server-Timing header and summed for /metrics.
+Rows written by streamed responses happen after the request hooks and
+are not counted.
+"""
+
+
+class RequestTiming:
+    __slots__ = ('started', 'db', 'queries', 'rows', 'serialize', 'profiler')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.db = 0.0
+        self.queries = 0
+        self.rows = 0
+        self.serialize = 0.0
+        self.profiler = None
+
+
+def current_timing():
+    # None outside a request (CLI commands, warm-up)
+    return g.get('_timing') if has_app_context() else None
+
+
+class Metrics:
+
+    def __init__(self):
+        self._endpoints = {}
+        self._lock = threading.Lock()
+        # name -> callable returning {'hits': n, 'misses': n}
+        self.caches = {}
+        # name -> (help text, callable returning a count)
+        self.counters = {}
+        # name -> (help text, callable returning the current value)
+        self.gauges = {}
+
+    def observe(self, endpoint, timing, total):
+        with self._lock:
+            stats = self._endpoints.get(endpoint)
+            if stats is None:
+                stats = self._endpoints[endpoint] = {
+                    'count': 0, 'total': 0.0, 'db': 0.0, 'queries': 0, 'rows': 0,
+                    'serialize': 0.0, 'buckets': [0] * len(BUCKETS)}
+            stats['count'] += 1
+            stats['total'] += total
+            stats['db'] += timing.db
+            stats['queries'] += timing.queries
+            stats['rows'] += timing.rows
+            stats['serialize'] += timing.serialize
+            for i, bound in enumerate(BUCKETS):
+                if total <= bound:
+                    stats['buckets'][i] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {e: dict(s, buckets=list(s['buckets'])) for e, s in self._endpoints.items()}
+
+    def render(self):
+        """Prometheus text exposition format."""
+        out = []
+
+        def metric(name, kind, help_text, samples):
+            out.append('# HELP {} {}'.format(name, help_text))
+            out.append('# TYPE {} {}'.format(name, kind))
+            for suffix, labels, value in samples:
+                label = ','.join('{}="{}"'.format(k, v) for k, v in labels)
+                out.append('{}{}{{{}}} {}'.format(name, suffix, label, value) if label
+                           else '{}{} {}'.format(name, suffix, value))
+
+        endpoints = sorted(self.snapshot().items())
+        samples = []
+        for endpoint, s in endpoints:
+            for bound, n in zip(BUCKETS, s['buckets']):
+                samples.append(('_bucket', (('endpoint', endpoint), ('le', bound)), n))
+            samples.append(('_bucket', (('endpoint', endpoint), ('le', '+Inf')), s['count']))
+            samples.append(('_sum', (('endpoint', endpoint),), round(s['total'], 6)))
+            samples.append(('_count', (('endpoint', endpoint),), s['count']))
+        metric('trivia_request_duration_seconds', 'histogram', 'Request duration.', samples)
+        metric('trivia_db_seconds_total', 'counter', 'Time spent executing SQL.',
+               [('', (('endpoint', e),), round(s['db'], 6)) for e, s in endpoints])
+        metric('trivia_db_queries_total', 'counter', 'SQL statements executed.',
+               [('', (('endpoint', e),), s['queries']) for e, s in endpoints])
+        metric('trivia_db_rows_total', 'counter', 'Rows returned or changed by SQL statements.',
+               [('', (('endpoint', e),), s['rows']) for e, s in endpoints])
+        metric('trivia_serialize_seconds_total', 'counter', 'Time spent encoding JSON.',
+               [('', (('endpoint', e),), round(s['serialize'], 6)) for e, s in endpoints])
+        for name, stats in sorted(self.caches.items()):
+            values = stats()
+            metric('trivia_{}_hits_total'.format(name), 'counter', '{} hits.'.format(name),
+                   [('', (), values['hits'])])
+            metric('trivia_{}_misses_total'.format(name), 'counter', '{} misses.'.format(name),
+                   [('', (), values['misses'])])
+        for name, (help_text, count) in sorted(self.counters.items()):
+            metric('trivia_{}_total'.format(name), 'counter', help_text, [('', (), count())])
+        for name, (help_text, value) in sorted(self.gauges.items()):
+            metric('trivia_{}'.format(name), 'gauge', help_text, [('', (), value())])
+        return '\n'.join(out) + '\n'
+
+
+def timed_encoder(base):
+    """A JSON encoder class that adds its encoding time to the current request."""
+
+    class TimedJSONEncoder(base):
+        def encode(self, o):
+            started = time.perf_counter()
+            try:
+                return super(TimedJSONEncoder, self).encode(o)
+            finally:
+                timing = current_timing()
+                if timing is not None:
+                    timing.serialize += time.perf_counter() - started
+
+    return TimedJSONEncoder
+
+
+def server_timing(timing, total):
+    return 'db;dur={:.3f};desc="{} queries, {} rows", serialize;dur={:.3f}, app;dur={:.3f}, total;dur={:.3f}'.format(
+        timing.db * 1000, timing.queries, timing.rows, timing.serialize * 1000,
+        max(0.0, total - timing.db - timing.serialize) * 1000, total * 1000)
+
+
+def profile_response(app, profiler):
+    out = io.StringIO()
+    stats = pstats.Stats(profiler, stream=out)
+    stats.sort_stats('cumulative').print_stats(PROFILE_LINES)
+    return app.response_class(out.getvalue(), mimetype='text/plain')
+
+
+def instrument(app, engine):
+    """
+    Registers the SQL events, request hooks, Server-Timing header and the
+    /metrics endpoint; ?profile=1 answers with a cProfile summary when
+    app.config['ALLOW_PROFILING'] is set. Returns the Metrics.
+    """
+    metrics = Metrics()
+    app.json_encoder = timed_encoder(app.json_encoder)
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_started'].pop()
+        timing = current_timing()
+        if timing is not None:
+            timing.db += elapsed
+            timing.queries += 1
+            if cursor.rowcount > 0:
+                timing.rows += cursor.rowcount
+
+    @app.before_request
+    def start_timing():
+        g._timing = timing = RequestTiming()
+        if app.config['ALLOW_PROFILING'] and request.args.get('profile') == '1':
+            timing.profiler = cProfile.Profile()
+            timing.profiler.enable()
+
+    @app.after_request
+    def finish_timing(response):
+        timing = current_timing()
+        if timing is None:
+            return response
+        total = time.perf_counter() - timing.started
+        if timing.profiler is not None:
+            timing.profiler.disable()
+            response = profile_response(app, timing.profiler)
+        metrics.observe(request.endpoint or 'unknown', timing, total)
+        response.headers['Server-Timing'] = server_timing(timing, total)
+        return response
+
+    @app.route("/metrics", methods=['GET'])
+    def metrics_endpoint():
+        return app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+    return metrics
@@ -0,0 +1,106 @@
+import bisect
+import threading
+import time
+
+# entries kept per leaderboard
+TOP_K = 100
+
+"""
+TopK
+    the k best entries of one leaderboard, as a sorted array keyed by
+    (-score, seq): higher scores first, earlier games first on ties.
+    Adding is a binary search and an insert into at most k entries; adding
+    a key that is already there changes nothing.
+"""
+
+
+class TopK:
+
+    def __init__(self, k):
+        self.k = k
+        self._keys = []
+        self._entries = []
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, score, seq, entry):
+        """Inserts entry; returns its 1-based rank, or None if it is not in the top k."""
+        key = (-score, seq)
+        if len(self._keys) >= self.k and key > self._keys[-1]:
+            return None
+        i = bisect.bisect_left(self._keys, key)
+        if i < len(self._keys) and self._keys[i] == key:
+            return i + 1
+        self._keys.insert(i, key)
+        self._entries.insert(i, entry)
+        if len(self._keys) > self.k:
+            self._keys.pop()
+            self._entries.pop()
+        return i + 1
+
+    def top(self, n):
+        return self._entries[:n]
+
+
+"""
+Leaderboard
+    a global TopK and one per category, built on first use from the k
+    best rows of each (index scans, see Score.__table_args__) and updated
+    as games are stored, keyed by score and row id. Every process keeps its
+    own boards, so with a ttl (seconds) they are rebuilt from the table
+    periodically to pick up games stored by other processes.
+"""
+
+
+class Leaderboard:
+
+    def __init__(self, loader, categories, k=TOP_K, ttl=None):
+        # loader(category, k) returns (id, player, category, score, total) for the k best
+        # scores of category (None for all games);
+        # categories() returns the categories that have scores
+        self.loader = loader
+        self.categories = categories
+        self.k = k
+        self.ttl = ttl
+        self._boards = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def _load(self):
+        boards = {}
+        for category in [None] + [c for c in self.categories() if c is not None]:
+            board = boards[category] = TopK(self.k)
+            for id, player, cat, score, total in self.loader(category, self.k):
+                board.add(score, id, {'player': player, 'category': cat, 'score': score, 'total': total})
+        self._boards = boards
+        self._loaded_at = time.monotonic()
+
+    def _ensure_loaded(self):
+        expired = self.ttl is not None and time.monotonic() - self._loaded_at > self.ttl
+        if self._boards is None or expired:
+            self._load()
+
+    def add(self, id, entry):
+        """
+        Adds a stored game (its scores row id and {'player', 'category',
+        'score', 'total'}); returns its global and category ranks.
+        """
+        with self._lock:
+            self._ensure_loaded()
+            rank = self._boards[None].add(entry['score'], id, entry)
+            category_rank = None
+            if entry['category'] is not None:
+                board = self._boards.setdefault(entry['category'], TopK(self.k))
+                category_rank = board.add(entry['score'], id, entry)
+            return rank, category_rank
+
+    def top(self, category=None, n=10):
+        with self._lock:
+            self._ensure_loaded()
+            board = self._boards.get(category)
+            return board.top(n) if board is not None else []
+
+    def invalidate(self):
+        with self._lock:
+            self._boards = None
@@ -0,0 +1,125 @@
+import random
+import threading
+from collections import OrderedDict
+
+# questions per pack, and packs kept in memory
+MAX_PACK_SIZE = 500
+MAX_PACKS = 1000
+
+"""
+Quiz packs
+
+build_pack(pools, size, seed, mix) picks size question ids from pools
+(difficulty -> ids) and shuffles them with a random.Random seeded by seed,
+so the same seed over the same questions always gives the same pack. mix
+(difficulty -> weight) splits size between difficulties; difficulties with
+too few questions are made up from the rest of the mix.
+
+PackCache keeps encoded packs by (category, seed, size, mix) until a
+question in their category changes. Packs are built outside its lock,
+one build per key at a time (see SingleFlight).
+"""
+
+
+def parse_mix(value):
+    """'1:2,3:1' -> {1: 2, 3: 1}; None for an empty value. Raises ValueError if malformed."""
+    if not value:
+        return None
+    mix = {}
+    for part in value.split(','):
+        difficulty, _, weight = part.partition(':')
+        weight = int(weight or 1)
+        if weight < 0:
+            raise ValueError(part)
+        mix[int(difficulty)] = weight
+    if not any(mix.values()):
+        raise ValueError(value)
+    return mix
+
+
+def quotas(mix, size):
+    """size split between the difficulties of mix by weight (largest remainder)."""
+    total = float(sum(mix.values()))
+    shares = {d: size * w / total for d, w in mix.items() if w > 0}
+    counts = {d: int(s) for d, s in shares.items()}
+    left = size - sum(counts.values())
+    for d in sorted(shares, key=lambda d: (counts[d] - shares[d], d))[:left]:
+        counts[d] += 1
+    return counts
+
+
+def build_pack(pools, size, seed, mix=None):
+    """The pack's question ids in play order."""
+    rng = random.Random(str(seed))
+    # pools come from swap-remove arrays, so they are sorted before drawing
+    if mix is None:
+        ids = sorted(qid for ids in pools.values() for qid in ids)
+        return rng.sample(ids, min(size, len(ids)))
+    picked = []
+    rest = []
+    for difficulty, n in sorted(quotas(mix, size).items()):
+        pool = sorted(pools.get(difficulty, ()))
+        chosen = rng.sample(pool, min(n, len(pool)))
+        picked.extend(chosen)
+        chosen = set(chosen)
+        rest.extend(qid for qid in pool if qid not in chosen)
+    short = size - len(picked)
+    if short > 0:
+        picked.extend(rng.sample(rest, min(short, len(rest))))
+    rng.shuffle(picked)
+    return picked
+
+
+class PackCache:
+
+    def __init__(self, flight, max_packs=MAX_PACKS):
+        self.flight = flight
+        self.max_packs = max_packs
+        self.hits = 0
+        self.misses = 0
+        self._packs = OrderedDict()
+        # bumped by every invalidation, so a pack built from older questions is not stored
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, category, seed, size, mix, build):
+        """The cached pack, or build() stored under its key; concurrent requests for a pack build it once."""
+        key = (None if category is None else str(category), str(seed), size,
+               tuple(sorted(mix.items())) if mix else None)
+        with self._lock:
+            pack = self._packs.get(key)
+            if pack is not None:
+                self.hits += 1
+                self._packs.move_to_end(key)
+                return pack
+            generation = self._generation
+
+        def load():
+            pack = build()
+            with self._lock:
+                self.misses += 1
+                if self._generation == generation:
+                    self._packs[key] = pack
+                    while len(self._packs) > self.max_packs:
+                        self._packs.popitem(last=False)
+            return pack
+
+        # requests arriving after an invalidation start a new build instead of joining an older one
+        return self.flight.do(('quiz_pack', generation) + key, load)
+
+    def invalidate(self, category):
+        """Drops the packs of category and the packs drawn from every category."""
+        category = str(category)
+        with self._lock:
+            self._generation += 1
+            for key in [k for k in self._packs if k[0] in (None, category)]:
+                del self._packs[key]
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._packs.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'packs': len(self._packs)}
@@ -0,0 +1,49 @@
+import threading
+import time
+
+from sqlalchemy import func
+
+"""
+CountCache
+    remembers the result of a COUNT query until a write invalidates it
+    (or until ttl seconds have passed, when a ttl is given)
+"""
+
+
+class CountCache:
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self._value = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, loader):
+        with self._lock:
+            expired = self.ttl is not None and time.monotonic() - self._loaded_at > self.ttl
+            if self._value is None or expired:
+                self._value = loader()
+                self._loaded_at = time.monotonic()
+            return self._value
+
+    def invalidate(self):
+        with self._lock:
+            self._value = None
+
+
+def count_rows(session, column):
+    """Runs SELECT count(column) instead of loading every row."""
+    return session.query(func.count(column)).scalar()
+
+
+def page_by_offset(query, column, page, per_page):
+    """Classic page=N paging, ordered by column so pages are stable."""
+    return query.order_by(column).offset((page - 1) * per_page).limit(per_page)
+
+
+def page_by_keyset(query, column, after_id, per_page):
+    """
+    Cursor paging on an indexed column (the primary key): every page is an
+    index range scan starting at after_id, so deep pages cost the same as page 1.
+    """
+    return query.filter(column > after_id).order_by(column).limit(per_page)
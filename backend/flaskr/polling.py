@@ -0,0 +1,41 @@
+import threading
+import time
+
+"""
+VersionPoll
+    notices when data shared with other processes changed, so this one can
+    drop the in-memory state built from it: read() returns the data's
+    current version (a counter, a row count...) and changed() calls it at
+    most once every interval seconds. The first read is the baseline.
+    bumped(version) records a change made by this process, when read()
+    would have returned version right after it.
+"""
+
+
+class VersionPoll:
+
+    def __init__(self, read, interval=1.0):
+        self.read = read
+        self.interval = interval
+        self.version = None
+        self._checked = None
+        self._lock = threading.Lock()
+
+    def bumped(self, version):
+        """Records a bump of our own, so the next poll does not report it."""
+        with self._lock:
+            if self.version is not None and version == self.version + 1:
+                self.version = version
+
+    def changed(self):
+        """True if the version moved since the last read."""
+        now = time.monotonic()
+        with self._lock:
+            if self._checked is not None and now - self._checked < self.interval:
+                return False
+            self._checked = now
+        version = self.read()
+        with self._lock:
+            changed = self.version is not None and version != self.version
+            self.version = version
+            return changed
@@ -0,0 +1,334 @@
+import random
+import secrets
+import threading
+import time
+from collections import OrderedDict, deque
+
+# random draws tried before falling back to a scan of the remaining ids
+MAX_DRAWS = 16
+# adaptive games: answers in the rolling score, and the share of them right
+# above which the difficulty goes up (or at or below which it goes down)
+SCORE_WINDOW = 4
+RAISE_AT = 0.75
+LOWER_AT = 0.25
+DEFAULT_DIFFICULTY = 3
+
+"""
+IdArray
+    a list of ids with O(1) append, O(1) swap-remove and O(1) random access
+"""
+
+
+class IdArray:
+
+    def __init__(self):
+        self.ids = []
+        self.pos = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, qid):
+        return qid in self.pos
+
+    def add(self, qid):
+        if qid not in self.pos:
+            self.pos[qid] = len(self.ids)
+            self.ids.append(qid)
+
+    def remove(self, qid):
+        i = self.pos.pop(qid, None)
+        if i is None:
+            return
+        last = self.ids.pop()
+        if i < len(self.ids):
+            self.ids[i] = last
+            self.pos[last] = i
+
+    def pick(self, exclude):
+        """Returns a random id not in exclude (a set), or None if every id is excluded."""
+        n = len(self.ids)
+        if n == 0:
+            return None
+        # while most ids are still unseen a few random draws find one without a scan
+        if len(exclude) < n // 2:
+            for _ in range(MAX_DRAWS):
+                qid = self.ids[random.randrange(n)]
+                if qid not in exclude:
+                    return qid
+        remaining = [qid for qid in self.ids if qid not in exclude]
+        if not remaining:
+            return None
+        return random.choice(remaining)
+
+
+def nearest(difficulties, target):
+    """difficulties ordered by distance from target, easier first on ties."""
+    return sorted(difficulties, key=lambda d: (abs(d - target), d))
+
+
+def difficulty_for(score, easiest=1, hardest=5):
+    """The target difficulty for a share of right answers between 0 and 1."""
+    score = min(1.0, max(0.0, float(score)))
+    return easiest + int(round(score * (hardest - easiest)))
+
+
+"""
+QuestionIndex
+    per-category and per-(category, difficulty) arrays of question ids,
+    loaded once with a narrow (id, category, difficulty) query and patched
+    by submit_que/delete_que
+"""
+
+
+class QuestionIndex:
+
+    def __init__(self, loader):
+        self.loader = loader
+        self._all = None
+        self._by_cat = {}
+        # category (None for every category) -> difficulty -> IdArray
+        self._by_level = {}
+        self._cat_of = {}
+        self._lock = threading.Lock()
+
+    def _load(self):
+        self._all = IdArray()
+        self._by_cat = {}
+        self._by_level = {}
+        self._cat_of = {}
+        for qid, category, difficulty in self.loader():
+            self._add(qid, category, difficulty)
+
+    def _ensure_loaded(self):
+        if self._all is None:
+            self._load()
+
+    def _add(self, qid, category, difficulty):
+        category = str(category)
+        self._all.add(qid)
+        self._by_cat.setdefault(category, IdArray()).add(qid)
+        for key in (category, None):
+            self._by_level.setdefault(key, {}).setdefault(difficulty, IdArray()).add(qid)
+        self._cat_of[qid] = (category, difficulty)
+
+    def _ids(self, category):
+        if category is None:
+            return self._all
+        return self._by_cat.get(str(category), IdArray())
+
+    def _levels(self, category):
+        levels = self._by_level.get(None if category is None else str(category), {})
+        # questions without a difficulty are only drawn by plain picks
+        return {d: ids for d, ids in levels.items() if d is not None and len(ids)}
+
+    def add(self, qid, category, difficulty=None):
+        with self._lock:
+            if self._all is not None:
+                self._add(qid, category, difficulty)
+
+    def remove(self, qid):
+        with self._lock:
+            if self._all is None:
+                return
+            placed = self._cat_of.pop(qid, None)
+            self._all.remove(qid)
+            if placed is not None:
+                category, difficulty = placed
+                self._by_cat[category].remove(qid)
+                self._by_level[category][difficulty].remove(qid)
+                self._by_level[None][difficulty].remove(qid)
+
+    def invalidate(self):
+        with self._lock:
+            self._all = None
+
+    def count(self, category=None):
+        """Number of questions in category (None for all categories)."""
+        with self._lock:
+            self._ensure_loaded()
+            return len(self._ids(category))
+
+    def ids(self, category=None):
+        """A copy of the question ids in category (None for all categories)."""
+        with self._lock:
+            self._ensure_loaded()
+            return list(self._ids(category).ids)
+
+    def pools(self, category=None):
+        """Copies of the question ids in category (None for all), by difficulty."""
+        with self._lock:
+            self._ensure_loaded()
+            return {d: list(ids.ids) for d, ids in self._levels(category).items()}
+
+    def levels(self, category=None):
+        """Number of questions in category (None for all) by difficulty, for the questions that have one."""
+        with self._lock:
+            self._ensure_loaded()
+            return {d: len(ids) for d, ids in self._levels(category).items()}
+
+    def pick(self, category=None, exclude=(), difficulty=None):
+        """
+        Draws a random question id from category that is not in exclude. With
+        a difficulty, draws from that difficulty, or the nearest one that
+        still has an unseen question.
+        """
+        with self._lock:
+            self._ensure_loaded()
+            if not isinstance(exclude, (set, frozenset)):
+                exclude = set(exclude)
+            if difficulty is None:
+                return self._ids(category).pick(exclude)
+            levels = self._levels(category)
+            for d in nearest(levels, difficulty):
+                qid = levels[d].pick(exclude)
+                if qid is not None:
+                    return qid
+            return None
+
+
+"""
+QuizSession
+    one game: question ids are drawn one per turn from the shared
+    QuestionIndex, skipping the ids already served (seen), so a session
+    holds only what it has played. Turns of one session are serialized
+    by its lock.
+"""
+
+
+class QuizSession:
+    __slots__ = ('token', 'category', 'seen', 'questions_per_play', 'answered', 'last_used', 'lock')
+
+    def __init__(self, category, questions_per_play):
+        self.token = None
+        self.category = category
+        self.seen = set()
+        self.questions_per_play = questions_per_play
+        self.answered = 0
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock()
+
+    def next_id(self, index):
+        """Draws an unseen question id from index, None once every id was seen or the play limit is reached."""
+        if self.questions_per_play is not None and self.answered >= self.questions_per_play:
+            return None
+        return index.pick(self.category, self.seen)
+
+
+"""
+AdaptiveQuizSession
+    a game whose difficulty follows the player: each turn draws an unseen
+    id from the shared pool nearest the target difficulty; the target moves
+    up or down, within the difficulties the category had when the game
+    started (levels), with the share of the last SCORE_WINDOW answers that
+    were right
+"""
+
+
+class AdaptiveQuizSession(QuizSession):
+    __slots__ = ('levels', 'difficulty', 'results')
+
+    def __init__(self, category, levels, questions_per_play, difficulty=DEFAULT_DIFFICULTY):
+        super(AdaptiveQuizSession, self).__init__(category, questions_per_play)
+        self.levels = sorted(levels)
+        self.difficulty = difficulty
+        self.results = deque(maxlen=SCORE_WINDOW)
+
+    def record(self, correct):
+        """Adds an answer to the rolling score and moves the target difficulty."""
+        self.results.append(bool(correct))
+        score = sum(self.results) / float(len(self.results))
+        levels = self.levels
+        if not levels:
+            return
+        if score >= RAISE_AT and self.difficulty < levels[-1]:
+            self.difficulty += 1
+            self.results.clear()
+        elif score <= LOWER_AT and self.difficulty > levels[0]:
+            self.difficulty -= 1
+            self.results.clear()
+
+    def next_id(self, index):
+        if self.questions_per_play is not None and self.answered >= self.questions_per_play:
+            return None
+        return index.pick(self.category, self.seen, self.difficulty)
+
+
+"""
+QuizSessionStore
+    token -> QuizSession, least recently used first; sessions idle for
+    longer than ttl seconds are dropped, and past max_sessions sessions or
+    max_ids seen ids (across all sessions) the least recently used ones
+    are evicted
+"""
+
+
+class QuizSessionStore:
+
+    def __init__(self, ttl=3600, max_sessions=10000, max_ids=1000000):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.max_ids = max_ids
+        self._sessions = OrderedDict()
+        # seen ids held by all sessions
+        self._ids = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _evict(self, now):
+        while self._sessions:
+            token, quiz = next(iter(self._sessions.items()))
+            if (now - quiz.last_used <= self.ttl and len(self._sessions) <= self.max_sessions
+                    and self._ids <= self.max_ids):
+                break
+            self._drop(token)
+
+    def _drop(self, token):
+        quiz = self._sessions.pop(token, None)
+        if quiz is not None:
+            self._ids -= len(quiz.seen)
+        return quiz
+
+    def start(self, category, questions_per_play=None):
+        """Starts a session drawing from category (None for all) and returns its token."""
+        return self._register(QuizSession(category, questions_per_play))
+
+    def start_adaptive(self, category, levels, questions_per_play=None, difficulty=DEFAULT_DIFFICULTY):
+        """Starts an adaptive session over levels (the difficulties from QuestionIndex.levels)."""
+        return self._register(AdaptiveQuizSession(category, levels, questions_per_play, difficulty))
+
+    def _register(self, quiz):
+        token = secrets.token_urlsafe(16)
+        quiz.token = token
+        with self._lock:
+            self._sessions[token] = quiz
+            self._evict(time.monotonic())
+        return token
+
+    def get(self, token):
+        """Returns the live session for token (refreshing its ttl) or None."""
+        with self._lock:
+            now = time.monotonic()
+            self._evict(now)
+            quiz = self._sessions.get(token)
+            if quiz is not None:
+                quiz.last_used = now
+                self._sessions.move_to_end(token)
+            return quiz
+
+    def served(self, quiz, qid):
+        """Marks qid as seen by quiz, evicting the least recently used sessions past max_ids."""
+        with self._lock:
+            if qid in quiz.seen:
+                return
+            quiz.seen.add(qid)
+            # an evicted session no longer counts against max_ids
+            if self._sessions.get(quiz.token) is quiz:
+                self._ids += 1
+                self._evict(time.monotonic())
+
+    def end(self, token):
+        with self._lock:
+            return self._drop(token) is not None
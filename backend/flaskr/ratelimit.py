@@ -0,0 +1,50 @@
+import threading
+import time
+from collections import OrderedDict
+
+# buckets kept in memory; the least recently used ones are dropped past this
+MAX_BUCKETS = 100000
+
+"""
+RateLimiter
+    a token bucket per (client, endpoint): each endpoint in rules has a
+    rate (tokens added per second) and a burst (bucket size); a request
+    takes one token or is throttled. Buckets live in process memory, so
+    with several worker processes each one enforces its own share.
+"""
+
+
+class RateLimiter:
+
+    def __init__(self, rules, max_buckets=MAX_BUCKETS):
+        # endpoint -> (rate per second, burst)
+        self.rules = rules
+        self.max_buckets = max_buckets
+        self.throttled = {}
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def allow(self, client, endpoint):
+        """(True, 0) if the request may go ahead, else (False, seconds until a token is free)."""
+        rule = self.rules.get(endpoint)
+        if rule is None:
+            return True, 0.0
+        rate, burst = rule
+        key = (client, endpoint)
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - last) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            else:
+                self.throttled[endpoint] = self.throttled.get(endpoint, 0) + 1
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        return allowed, 0.0 if allowed else (1 - tokens) / rate
+
+    def stats(self):
+        with self._lock:
+            return {'throttled': sum(self.throttled.values()), 'by_endpoint': dict(self.throttled)}
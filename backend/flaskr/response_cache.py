@@ -0,0 +1,243 @@
+import functools
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from flask import request
+
+from flaskr.encoding import compress_variants, negotiate, use_encoding
+from flaskr.streaming import NDJSON
+
+# rough per-entry bookkeeping cost added to the body size
+ENTRY_OVERHEAD = 256
+
+"""
+Response cache
+
+Read endpoints are cached by endpoint name, URL arguments (the category
+id), normalized query arguments and (for POST searches) the normalized
+JSON body. Each entry is stored with
+the versions of its tags ('questions'); invalidate(tag)
+bumps the tag's version, so every entry built from older data misses from
+then on without having to be found and deleted.
+
+Entries carry an ETag and Last-Modified, so clients and CDNs revalidate
+with a 304 instead of downloading the body again. With COMPRESS on, an
+entry also keeps its gzip/brotli bodies, compressed once when it is stored.
+
+Backends: MemoryBackend (default, LRU bounded by a byte budget) or
+RedisBackend for a cache shared by several processes ('redis://' URL,
+needs the redis package; any Redis-compatible server works). Tag versions
+live in the backend, so with Redis an invalidation by any process (a
+worker, `flask import-questions`) reaches all of them. A memory cache only
+sees its own process's invalidations, so entries older than ttl seconds
+are not served by either backend.
+"""
+
+
+def entry_size(entry):
+    return len(entry['body']) + sum(len(b) for b in entry['encoded'].values()) + ENTRY_OVERHEAD
+
+
+class MemoryBackend:
+    shared = False
+
+    def __init__(self, max_bytes, ttl=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.bytes = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self.ttl is not None and time.monotonic() - entry['stored_at'] > self.ttl:
+                del self._entries[key]
+                self.bytes -= entry['size']
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        size = entry_size(entry)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old['size']
+            entry['size'] = size
+            entry['stored_at'] = time.monotonic()
+            self._entries[key] = entry
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= evicted['size']
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old['size']
+
+    def versions(self, tags):
+        with self._lock:
+            return [self._versions.get(t, 0) for t in tags]
+
+    def bump(self, tag):
+        with self._lock:
+            self._versions[tag] = version = self._versions.get(tag, 0) + 1
+            return version
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+
+class RedisBackend:
+    shared = True
+
+    def __init__(self, url, max_bytes, ttl=None, prefix='trivia:cache:'):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.bytes = None
+        self.evictions = None
+        # the server's maxmemory/LRU policy does the byte budgeting for shared caches
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            return None
+        entry = json.loads(raw)
+        entry['body'] = entry['body'].encode('latin-1')
+        entry['encoded'] = {k: v.encode('latin-1') for k, v in entry['encoded'].items()}
+        return entry
+
+    def set(self, key, entry):
+        if entry_size(entry) > self.max_bytes:
+            return
+        raw = dict(entry, body=entry['body'].decode('latin-1'),
+                   encoded={k: v.decode('latin-1') for k, v in entry['encoded'].items()})
+        self.client.set(self.prefix + key, json.dumps(raw), ex=self.ttl)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def versions(self, tags):
+        values = self.client.mget([self.prefix + 'tag:' + t for t in tags])
+        return [int(v) if v is not None else 0 for v in values]
+
+    def bump(self, tag):
+        return self.client.incr(self.prefix + 'tag:' + tag)
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + '*'):
+            self.client.delete(key)
+
+
+def request_key(vary=None):
+    """The current request's endpoint, method, URL arguments, sorted query args and JSON body, hashed."""
+    view_args = sorted((request.view_args or {}).items())
+    args = sorted(request.args.items(multi=True))
+    body = request.get_json(silent=True) if request.method == 'POST' else None
+    extra = vary() if vary is not None else None
+    raw = json.dumps([request.endpoint, request.method, view_args, args, body, extra], sort_keys=True)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def uncacheable():
+    # streamed and profiled responses are never stored, shared or served from a cache
+    return ('profile' in request.args or 'stream' in request.args
+            or request.accept_mimetypes.best == NDJSON)
+
+
+def make_entry(app, body, mimetype, etag=None):
+    """A cacheable 200 response: body, ETag, Last-Modified and, with COMPRESS on, its compressed bodies."""
+    config = app.config
+    encoded = (compress_variants(body, config['COMPRESS_MIN_BYTES'], config['COMPRESS_LEVEL'])
+               if config['COMPRESS'] else {})
+    return {'body': body, 'status': 200, 'mimetype': mimetype, 'etag': etag or hashlib.sha1(body).hexdigest(),
+            'last_modified': int(time.time()), 'encoded': encoded}
+
+
+def entry_response(app, entry):
+    """The response for entry, in the encoding the client prefers; 304 if it revalidates."""
+    response = app.response_class(entry['body'], status=entry['status'], mimetype=entry['mimetype'])
+    response.set_etag(entry['etag'])
+    response.last_modified = entry['last_modified']
+    if entry['encoded']:
+        response.vary.add('Accept-Encoding')
+        encoding = negotiate(request.accept_encodings)
+        if encoding is not None:
+            use_encoding(response, encoding, entry['encoded'][encoding])
+    return response.make_conditional(request)
+
+
+def make_backend(url, max_bytes, ttl=None):
+    if url and url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisBackend(url, max_bytes, ttl)
+    return MemoryBackend(max_bytes, ttl)
+
+
+class ResponseCache:
+
+    def __init__(self, app, backend, enabled=True):
+        self.app = app
+        self.backend = backend
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+
+    def invalidate(self, tag):
+        """Bumps tag's version; returns the new one."""
+        return self.backend.bump(tag)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'bytes': self.backend.bytes, 'evictions': self.backend.evictions}
+
+    def cached(self, *tags, vary=None):
+        """
+        Caches the decorated view's 200 responses under tags; vary() is
+        added to the key for inputs that change without an invalidation
+        (the category ETag, which follows CATEGORY_CACHE_TTL reloads).
+        """
+
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                if not self.enabled or uncacheable():
+                    return view(*args, **kwargs)
+                key = request_key(vary)
+                versions = self.backend.versions(tags)
+                entry = self.backend.get(key)
+                if entry is not None and entry['versions'] == versions:
+                    self.hits += 1
+                    return entry_response(self.app, entry)
+                self.misses += 1
+
+                response = self.app.make_response(view(*args, **kwargs))
+                if response.status_code != 200 or response.is_streamed:
+                    return response
+                etag, _ = response.get_etag()
+                entry = make_entry(self.app, response.get_data(), response.mimetype, etag)
+                entry['versions'] = versions
+                self.backend.set(key, entry)
+                return entry_response(self.app, entry)
+
+            return wrapper
+
+        return decorator
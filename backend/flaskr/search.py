@@ -0,0 +1,207 @@
+import re
+import threading
+
+from sqlalchemy import func, or_
+
+WORD = re.compile(r'\w+')
+
+"""
+Question search
+
+Searching keeps the original contract: a question matches when the search
+term is a case-insensitive substring of it (or of its answer, when answers
+are searched). Results are ranked by how often the words of the term occur
+as whole words, then by id.
+
+PostgresSearch runs the ILIKE in SQL, where the pg_trgm GIN indexes made by
+models.create_search_indexes let it skip the sequential scan, and ranks with
+ts_rank. PythonSearch answers the same queries from an in-memory trigram
+inverted index, for databases without those indexes (SQLite test databases).
+"""
+
+
+def escape_like(term):
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def words(text):
+    return WORD.findall((text or '').lower())
+
+
+def rank(term, question, answer=None):
+    """Whole-word hits of the term's words; hits in the answer weigh half."""
+    wanted = set(words(term))
+    score = sum(1 for w in words(question) if w in wanted)
+    if answer is not None:
+        score += 0.5 * sum(1 for w in words(answer) if w in wanted)
+    return score
+
+
+class PostgresSearch:
+
+    def __init__(self, session, model):
+        self.session = session
+        self.model = model
+
+    # the database keeps its own indexes up to date
+    def add(self, qid, question, answer):
+        pass
+
+    def remove(self, qid):
+        pass
+
+    def invalidate(self):
+        pass
+
+    def _filter(self, term, include_answers):
+        pattern = '%' + escape_like(term) + '%'
+        match = self.model.question.ilike(pattern, escape='\\')
+        if include_answers:
+            match = or_(match, self.model.answer.ilike(pattern, escape='\\'))
+        return match
+
+    def count(self, term, include_answers=False):
+        return self.session.query(func.count(self.model.id)) \
+            .filter(self._filter(term, include_answers)).scalar()
+
+    def search(self, term, include_answers=False, offset=0, limit=None):
+        que = self._ranked(term, include_answers).offset(offset)
+        if limit is not None:
+            que = que.limit(limit)
+        return que.all()
+
+    def iter_search(self, term, include_answers=False, batch_size=1000):
+        """Every match, fetched batch_size rows at a time from a server-side cursor."""
+        return self._ranked(term, include_answers) \
+            .execution_options(stream_results=True).yield_per(batch_size)
+
+    def _ranked(self, term, include_answers):
+        query = func.plainto_tsquery('simple', term)
+        score = func.ts_rank(func.to_tsvector('simple', self.model.question), query)
+        if include_answers:
+            score = score + 0.5 * func.ts_rank(
+                func.to_tsvector('simple', func.coalesce(self.model.answer, '')), query)
+        return self.session.query(self.model).filter(self._filter(term, include_answers)) \
+            .order_by(score.desc(), self.model.id)
+
+
+"""
+TrigramIndex
+    text field -> postings of its lowercased 3-character windows; a term can
+    only be a substring of texts holding every window of the term
+"""
+
+
+class TrigramIndex:
+
+    def __init__(self):
+        self.postings = {}
+        self.texts = {}
+
+    @staticmethod
+    def grams(text):
+        return {text[i:i + 3] for i in range(len(text) - 2)}
+
+    def add(self, qid, text):
+        text = (text or '').lower()
+        self.texts[qid] = text
+        for gram in self.grams(text):
+            self.postings.setdefault(gram, set()).add(qid)
+
+    def remove(self, qid):
+        text = self.texts.pop(qid, None)
+        if text is None:
+            return
+        for gram in self.grams(text):
+            ids = self.postings.get(gram)
+            if ids is not None:
+                ids.discard(qid)
+                if not ids:
+                    del self.postings[gram]
+
+    def match(self, term):
+        term = term.lower()
+        grams = self.grams(term)
+        if grams:
+            lists = sorted((self.postings.get(g, set()) for g in grams), key=len)
+            candidates = set.intersection(*lists)
+        else:
+            # terms shorter than a trigram have to be checked against every text
+            candidates = self.texts.keys()
+        return {qid for qid in candidates if term in self.texts[qid]}
+
+
+class PythonSearch:
+
+    def __init__(self, session, model):
+        self.session = session
+        self.model = model
+        self._questions = None
+        self._answers = None
+        self._lock = threading.Lock()
+
+    def _ensure_loaded(self):
+        if self._questions is None:
+            self._questions = TrigramIndex()
+            self._answers = TrigramIndex()
+            rows = self.session.query(self.model.id, self.model.question, self.model.answer)
+            for qid, question, answer in rows:
+                self._questions.add(qid, question)
+                self._answers.add(qid, answer)
+
+    def add(self, qid, question, answer):
+        with self._lock:
+            if self._questions is not None:
+                self._questions.add(qid, question)
+                self._answers.add(qid, answer)
+
+    def remove(self, qid):
+        with self._lock:
+            if self._questions is not None:
+                self._questions.remove(qid)
+                self._answers.remove(qid)
+
+    def invalidate(self):
+        with self._lock:
+            self._questions = None
+            self._answers = None
+
+    def _ranked_ids(self, term, include_answers):
+        with self._lock:
+            self._ensure_loaded()
+            ids = self._questions.match(term)
+            if include_answers:
+                ids |= self._answers.match(term)
+            questions, answers = self._questions.texts, self._answers.texts
+
+            def key(qid):
+                answer = answers.get(qid) if include_answers else None
+                return -rank(term, questions.get(qid), answer), qid
+
+            return sorted(ids, key=key)
+
+    def count(self, term, include_answers=False):
+        return len(self._ranked_ids(term, include_answers))
+
+    def _fetch(self, ids):
+        if not ids:
+            return []
+        rows = {q.id: q for q in self.session.query(self.model).filter(self.model.id.in_(ids))}
+        return [rows[qid] for qid in ids if qid in rows]
+
+    def search(self, term, include_answers=False, offset=0, limit=None):
+        ids = self._ranked_ids(term, include_answers)
+        ids = ids[offset:] if limit is None else ids[offset:offset + limit]
+        return self._fetch(ids)
+
+    def iter_search(self, term, include_answers=False, batch_size=1000):
+        ids = self._ranked_ids(term, include_answers)
+        for i in range(0, len(ids), batch_size):
+            for q in self._fetch(ids[i:i + batch_size]):
+                yield q
+
+
+def make_search(session, model, dialect):
+    if dialect == 'postgresql':
+        return PostgresSearch(session, model)
+    return PythonSearch(session, model)
@@ -0,0 +1,83 @@
+import functools
+import threading
+
+from flaskr.response_cache import request_key, uncacheable
+
+"""
+SingleFlight
+    coalesces identical concurrent requests: the first one runs the view,
+    the ones arriving while it runs wait for it and answer with a copy of
+    its response, so a burst of the same listing or search costs one query.
+    Requests are identical when their response cache key is (endpoint,
+    URL args, query args, JSON body); streamed and profiled requests are
+    never shared.
+"""
+
+
+class Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+
+    def __init__(self, app, enabled=True):
+        self.app = app
+        self.enabled = enabled
+        self.coalesced = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """Runs fn, or waits for the call already running under key and returns its result."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Call()
+            else:
+                self.coalesced += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def stats(self):
+        return {'coalesced': self.coalesced}
+
+    def coalesce(self, vary=None):
+        """Shares the decorated view's response between identical concurrent requests."""
+
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                if not self.enabled or uncacheable():
+                    return view(*args, **kwargs)
+
+                def run():
+                    response = self.app.make_response(view(*args, **kwargs))
+                    headers = [(k, v) for k, v in response.headers if k.lower() != 'content-length']
+                    return response.status_code, headers, response.get_data()
+
+                status, headers, body = self.do(request_key(vary), run)
+                # every waiter gets its own response object for the after_request hooks to change
+                return self.app.response_class(body, status=status, headers=headers)
+
+            return wrapper
+
+        return decorator
@@ -0,0 +1,78 @@
+import threading
+
+"""
+QuestionStats
+    question counts per (category, difficulty), computed once with one
+    GROUP BY and then kept up to date by submit_que, delete_que and the
+    bulk loaders, so reading them costs O(categories x difficulties)
+    however many questions there are. recompute() redoes the GROUP BY.
+"""
+
+
+class QuestionStats:
+
+    def __init__(self, loader):
+        # loader returns (category, difficulty, count) rows
+        self.loader = loader
+        self._counts = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        self._counts = {}
+        for category, difficulty, count in self.loader():
+            self._counts[(category, difficulty)] = count
+
+    def _change(self, category, difficulty, n):
+        if self._counts is None:
+            return
+        key = (category, difficulty)
+        count = self._counts.get(key, 0) + n
+        if count > 0:
+            self._counts[key] = count
+        else:
+            self._counts.pop(key, None)
+
+    def add(self, category, difficulty, n=1):
+        with self._lock:
+            self._change(category, difficulty, n)
+
+    def remove(self, category, difficulty, n=1):
+        with self._lock:
+            self._change(category, difficulty, -n)
+
+    def add_rows(self, rows):
+        """Counts inserted rows (dicts with category and difficulty), e.g. a bulk load batch."""
+        with self._lock:
+            for row in rows:
+                self._change(row['category'], row['difficulty'], 1)
+
+    def invalidate(self):
+        with self._lock:
+            self._counts = None
+
+    def recompute(self):
+        with self._lock:
+            self._load()
+
+    def summary(self, categories):
+        """
+        Totals per category (categories: id -> type, every category is listed)
+        and per difficulty, overall and within each category.
+        """
+        with self._lock:
+            if self._counts is None:
+                self._load()
+            counts = dict(self._counts)
+        by_category = {}
+        difficulties = {}
+        for (category, difficulty), count in counts.items():
+            entry = by_category.setdefault(category, {"total": 0, "difficulties": {}})
+            entry["total"] += count
+            key = str(difficulty)
+            entry["difficulties"][key] = entry["difficulties"].get(key, 0) + count
+            difficulties[key] = difficulties.get(key, 0) + count
+        rows = []
+        for id, type in sorted(categories.items()):
+            entry = by_category.get(id, {"total": 0, "difficulties": {}})
+            rows.append({"id": id, "type": type, "total": entry["total"], "difficulties": entry["difficulties"]})
+        return {"total_questions": sum(counts.values()), "categories": rows, "difficulties": difficulties}
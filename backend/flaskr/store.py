@@ -0,0 +1,141 @@
+import bisect
+import threading
+
+from flaskr.encoding import dumps
+
+"""
+QuestionStore
+    the questions table held in memory for read-mostly serving
+    (QUESTION_STORE in the app config). Each question is a QuestionRecord
+    with its JSON encoding prepared once; ids are kept in sorted arrays for
+    the whole table and per category, so pages and category listings are
+    slices instead of ORM queries. Loaded on first use with one narrow query
+    and patched by submit_que/delete_que.
+"""
+
+
+def encode(fields):
+    # the same encoding flask.jsonify uses outside debug mode
+    return dumps(fields)
+
+
+class QuestionRecord:
+    __slots__ = ('id', 'question', 'answer', 'category', 'difficulty', 'json')
+
+    def __init__(self, id, question, answer, category, difficulty):
+        self.id = id
+        self.question = question
+        self.answer = answer
+        self.category = category
+        self.difficulty = difficulty
+        self.json = encode(self.format()).encode('utf-8')
+
+    def format(self):
+        return {
+            'id': self.id,
+            'question': self.question,
+            'answer': self.answer,
+            'category': self.category,
+            'difficulty': self.difficulty
+        }
+
+
+def insort(ids, qid):
+    # new questions get the highest id, so appending is the usual case
+    if not ids or ids[-1] < qid:
+        ids.append(qid)
+    else:
+        bisect.insort(ids, qid)
+
+
+def discard(ids, qid):
+    i = bisect.bisect_left(ids, qid)
+    if i < len(ids) and ids[i] == qid:
+        del ids[i]
+
+
+class QuestionStore:
+
+    def __init__(self, loader):
+        # loader returns (id, question, answer, category, difficulty) rows
+        self.loader = loader
+        self._by_id = None
+        self._ids = []
+        self._by_cat = {}
+        self._lock = threading.Lock()
+
+    def _load(self):
+        self._by_id = {}
+        self._ids = []
+        self._by_cat = {}
+        for row in self.loader():
+            self._add(QuestionRecord(*row))
+
+    def _ensure_loaded(self):
+        if self._by_id is None:
+            self._load()
+
+    def _add(self, record):
+        self._by_id[record.id] = record
+        insort(self._ids, record.id)
+        insort(self._by_cat.setdefault(record.category, []), record.id)
+
+    def add(self, que):
+        with self._lock:
+            if self._by_id is not None:
+                self._add(QuestionRecord(que.id, que.question, que.answer, que.category, que.difficulty))
+
+    def remove(self, qid):
+        with self._lock:
+            if self._by_id is None:
+                return
+            record = self._by_id.pop(qid, None)
+            if record is None:
+                return
+            discard(self._ids, qid)
+            discard(self._by_cat[record.category], qid)
+
+    def invalidate(self):
+        with self._lock:
+            self._by_id = None
+
+    def _records(self, ids):
+        return [self._by_id[qid] for qid in ids]
+
+    def count(self):
+        with self._lock:
+            self._ensure_loaded()
+            return len(self._ids)
+
+    def get(self, qid):
+        """The record for qid, or None."""
+        with self._lock:
+            self._ensure_loaded()
+            return self._by_id.get(qid)
+
+    def page(self, offset, limit):
+        """Records ordered by id, like page_by_offset."""
+        with self._lock:
+            self._ensure_loaded()
+            return self._records(self._ids[max(0, offset):max(0, offset) + limit])
+
+    def after(self, after_id, limit):
+        """Records with an id above after_id, like page_by_keyset."""
+        with self._lock:
+            self._ensure_loaded()
+            i = bisect.bisect_right(self._ids, after_id)
+            return self._records(self._ids[i:i + limit])
+
+    def category(self, category):
+        """Records of one category ordered by id."""
+        with self._lock:
+            self._ensure_loaded()
+            return self._records(self._by_cat.get(category, ()))
+
+
+def records_body(records, fields):
+    """{"questions": [...], **fields} as bytes, splicing in each record's prepared JSON."""
+    body = b'{"questions":[' + b','.join(r.json for r in records) + b']'
+    for key, value in sorted(fields.items()):
+        body += b',' + encode(key).encode('utf-8') + b':' + encode(value).encode('utf-8')
+    return body + b'}\n'
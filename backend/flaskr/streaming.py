@@ -0,0 +1,62 @@
+from flask import stream_with_context
+
+from flaskr.encoding import dumps
+
+NDJSON = 'application/x-ndjson'
+STREAM_BATCH = 1000
+
+"""
+Streaming question listings
+
+stream_mode(request) picks the response mode for a listing endpoint:
+  'ndjson' when the client prefers application/x-ndjson (one question per line)
+  'json'   for ?stream=1 (the usual JSON document, written out row by row)
+  None     for the buffered flask.jsonify response
+Rows come from a yield_per cursor and are encoded one at a time, so memory
+does not grow with the size of the result.
+"""
+
+
+def stream_mode(request):
+    if request.accept_mimetypes.best == NDJSON:
+        return 'ndjson'
+    if request.args.get('stream') in ('1', 'true'):
+        return 'json'
+    return None
+
+
+def stream_rows(query, batch_size=STREAM_BATCH):
+    """Runs query on a server-side cursor, batch_size rows per fetch."""
+    return query.execution_options(stream_results=True).yield_per(batch_size)
+
+
+def ndjson_body(rows):
+    for q in rows:
+        yield dumps(q.format()) + '\n'
+
+
+def json_body(rows, tail):
+    """
+    Writes {"questions": [...], **tail(count)} without holding the list;
+    tail gets the number of rows written and returns the remaining fields.
+    """
+    yield '{"questions": ['
+    count = 0
+    for q in rows:
+        if count:
+            yield ', '
+        yield dumps(q.format())
+        count += 1
+    yield ']'
+    for key, value in tail(count).items():
+        yield ', ' + dumps(key) + ': ' + dumps(value)
+    yield '}\n'
+
+
+def streamed_response(app, mode, rows, tail):
+    if mode == 'ndjson':
+        body, mimetype = ndjson_body(rows), NDJSON
+    else:
+        body, mimetype = json_body(rows, tail), 'application/json'
+    # keep the request (and its session) alive until the last row is sent
+    return app.response_class(stream_with_context(body), mimetype=mimetype)
@@ -0,0 +1,144 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+log = logging.getLogger(__name__)
+
+# queued by close(): the thread writes what came before it and stops
+STOP = object()
+
+"""
+BatchWriter
+    a background thread that writes queued items in groups: flush(items)
+    is called with up to max_batch items, as soon as max_batch are queued
+    or max_delay seconds after the first one arrived. submit() returns a
+    Future resolved with flush's result for that item once the group is
+    written; flush fails an item by returning an exception in its place,
+    and if flush raises, every item of the group fails. Cancelling a
+    Future before its group is taken keeps the item from being written.
+    The thread starts with the first submit. close() writes everything
+    submitted so far, including a group the thread is in the middle of,
+    and a later submit starts a new thread; it runs at exit, and processes that leave with os._exit (serve.py
+    workers) call it themselves.
+"""
+
+
+class BatchWriter:
+
+    def __init__(self, app, flush, max_batch=500, max_delay=0.05, max_queue=10000):
+        self.app = app
+        self.flush = flush
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._registered = False
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.rows = 0
+        self.flush_seconds = 0.0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+
+    def submit(self, item, timeout=5):
+        """Queues item; raises queue.Full if the queue stays full for timeout seconds."""
+        self._start()
+        future = Future()
+        self._queue.put((item, future), timeout=timeout)
+        return future
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='batch-writer', daemon=True)
+                self._thread.start()
+                if not self._registered:
+                    atexit.register(self.close)
+                    self._registered = True
+
+    def _take(self):
+        # blocks for the first item, then waits at most max_delay for the rest of the group;
+        # returns the group and whether close() asked the thread to stop
+        first = self._queue.get()
+        if first is STOP:
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                entry = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is STOP:
+                return batch, True
+            batch.append(entry)
+        return batch, False
+
+    def _run(self):
+        stop = False
+        while not stop:
+            batch, stop = self._take()
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch):
+        # items cancelled while queued are dropped; the rest can no longer be cancelled
+        batch = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        items = [item for item, _ in batch]
+        started = time.perf_counter()
+        try:
+            with self.app.app_context():
+                results = self.flush(items)
+        except Exception as e:
+            log.exception("batch of %d not written", len(items))
+            results = [e] * len(items)
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.batches += 1
+            self.rows += len(items)
+            self.flush_seconds += elapsed
+            self.last_flush_seconds = elapsed
+            self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+        for (_, future), result in zip(batch, results or [None] * len(batch)):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def stats(self):
+        with self._lock:
+            return {'queued': self._queue.qsize(), 'batches': self.batches, 'rows': self.rows,
+                    'flush_seconds': self.flush_seconds, 'last_flush_seconds': self.last_flush_seconds,
+                    'max_flush_seconds': self.max_flush_seconds}
+
+    def close(self, timeout=10):
+        """Writes everything submitted so far and stops the thread; for shutdown."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None and thread.is_alive():
+            self._queue.put(STOP)
+            thread.join(timeout)
+        self.drain()
+
+    def drain(self):
+        """Writes everything queued so far on the calling thread."""
+        batch = []
+        while True:
+            try:
+                entry = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is STOP:
+                continue
+            batch.append(entry)
+            if len(batch) == self.max_batch:
+                self._write(batch)
+                batch = []
+        if batch:
+            self._write(batch)
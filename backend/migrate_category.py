@@ -0,0 +1,132 @@
+"""
+Migrates questions.category to an integer foreign key to categories.id
+and adds the indexes declared on the Question model.
+
+Safe to run against a live PostgreSQL database and safe to re-run:
+
+1. a nullable category_id column is added (no table rewrite) and a trigger
+   keeps it in step with category for rows written during the migration
+2. existing rows are copied in batches of --batch-size ids, one short
+   transaction each, so no long lock is held
+3. category_id takes the place of category in one short transaction; the
+   text column is kept as category_old until --drop-old is given
+4. the indexes are built with CREATE INDEX CONCURRENTLY and the foreign key
+   is added NOT VALID, then validated without blocking writes
+
+Databases whose category column is already an integer (like the one
+trivia.psql creates) only go through step 4.
+
+    python migrate_category.py [--batch-size 5000] [--drop-old]
+"""
+import argparse
+import time
+
+from sqlalchemy import create_engine
+
+from settings import database_path
+
+INDEXES = {
+    'ix_questions_category_id': 'questions (category, id)',
+    'ix_questions_difficulty': 'questions (difficulty)',
+}
+
+
+def column_type(conn, column):
+    return conn.execute(
+        "SELECT data_type FROM information_schema.columns "
+        "WHERE table_name = 'questions' AND column_name = %s", (column,)).scalar()
+
+
+def has_constraint(conn, name):
+    return conn.execute(
+        "SELECT 1 FROM pg_constraint WHERE conname = %s", (name,)).scalar() is not None
+
+
+def add_shadow_column(engine):
+    with engine.begin() as conn:
+        conn.execute("ALTER TABLE questions ADD COLUMN IF NOT EXISTS category_id integer")
+        conn.execute("""
+            CREATE OR REPLACE FUNCTION questions_category_id_sync() RETURNS trigger AS $$
+            BEGIN
+                NEW.category_id := (SELECT id FROM categories WHERE id =
+                    CASE WHEN NEW.category ~ '^[0-9]+$' THEN NEW.category::integer END);
+                RETURN NEW;
+            END
+            $$ LANGUAGE plpgsql""")
+        conn.execute("DROP TRIGGER IF EXISTS questions_category_id_sync ON questions")
+        conn.execute("""
+            CREATE TRIGGER questions_category_id_sync BEFORE INSERT OR UPDATE OF category ON questions
+            FOR EACH ROW EXECUTE PROCEDURE questions_category_id_sync()""")
+
+
+def backfill(engine, batch_size):
+    with engine.connect() as conn:
+        last_id = conn.execute("SELECT coalesce(max(id), 0) FROM questions").scalar()
+    low = 0
+    while low < last_id:
+        high = low + batch_size
+        started = time.perf_counter()
+        with engine.begin() as conn:
+            # categories that are not numbers (or point at no category) become NULL
+            rows = conn.execute("""
+                UPDATE questions SET category_id = (SELECT id FROM categories WHERE id =
+                    CASE WHEN questions.category ~ '^[0-9]+$' THEN questions.category::integer END)
+                WHERE id > %s AND id <= %s""", (low, high)).rowcount
+        print("ids {}-{}: {} rows in {:.3f}s".format(low + 1, high, rows, time.perf_counter() - started))
+        low = high
+
+
+def swap_columns(engine):
+    with engine.begin() as conn:
+        conn.execute("SET LOCAL lock_timeout = '5s'")
+        conn.execute("DROP TRIGGER IF EXISTS questions_category_id_sync ON questions")
+        conn.execute("DROP FUNCTION IF EXISTS questions_category_id_sync()")
+        conn.execute("ALTER TABLE questions RENAME COLUMN category TO category_old")
+        conn.execute("ALTER TABLE questions RENAME COLUMN category_id TO category")
+
+
+def create_indexes(engine):
+    # CONCURRENTLY cannot run inside a transaction block
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for name, target in INDEXES.items():
+            conn.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS {} ON {}".format(name, target))
+
+
+def add_foreign_key(engine):
+    with engine.begin() as conn:
+        if has_constraint(conn, 'questions_category_fkey') or has_constraint(conn, 'category'):
+            return
+        conn.execute("""
+            ALTER TABLE questions ADD CONSTRAINT questions_category_fkey
+            FOREIGN KEY (category) REFERENCES categories (id) ON UPDATE CASCADE ON DELETE SET NULL
+            NOT VALID""")
+    with engine.begin() as conn:
+        conn.execute("ALTER TABLE questions VALIDATE CONSTRAINT questions_category_fkey")
+
+
+def migrate(engine, batch_size=5000, drop_old=False):
+    if engine.dialect.name != 'postgresql':
+        raise SystemExit("only PostgreSQL needs migrating; other databases get the new schema from create_all")
+    with engine.connect() as conn:
+        current = column_type(conn, 'category')
+        old = column_type(conn, 'category_old')
+    if current != 'integer':
+        add_shadow_column(engine)
+        backfill(engine, batch_size)
+        swap_columns(engine)
+        print("category is now an integer column, the old values are in category_old")
+    create_indexes(engine)
+    add_foreign_key(engine)
+    if drop_old and (old or current != 'integer'):
+        with engine.begin() as conn:
+            conn.execute("ALTER TABLE questions DROP COLUMN IF EXISTS category_old")
+        print("dropped category_old")
+    print("done")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert questions.category to an integer foreign key.")
+    parser.add_argument("--batch-size", type=int, default=5000, help="ids copied per transaction")
+    parser.add_argument("--drop-old", action="store_true", help="drop the old text column")
+    args = parser.parse_args()
+    migrate(create_engine(database_path), args.batch_size, args.drop_old)
@@ -1,9 +1,11 @@
+import logging
 import os
-from sqlalchemy import Column, String, Integer, create_engine
+import sqlite3
+from sqlalchemy import Column, String, Integer, DateTime, ForeignKey, Index, create_engine, event, func
+from sqlalchemy.engine import Engine
 from flask_sqlalchemy import SQLAlchemy
 import json
-from sqlalchemy_utils.functions import database_exists, create_database
-from settings import database_path
+from settings import database_path, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_RECYCLE, DB_POOL_PRE_PING, DB_INIT
 
 db = SQLAlchemy()
 
@@ -13,14 +15,70 @@ setup_db(app)
 """
 
 
-def setup_db(app, database_path=database_path):
+def engine_options(database_path):
+    options = {"pool_pre_ping": DB_POOL_PRE_PING, "pool_recycle": DB_POOL_RECYCLE}
+    if not database_path.startswith("sqlite"):
+        # SQLite uses a single-connection pool that takes no size settings
+        options["pool_size"] = DB_POOL_SIZE
+        options["max_overflow"] = DB_MAX_OVERFLOW
+    return options
+
+
+@event.listens_for(Engine, "connect")
+def sqlite_foreign_keys(dbapi_connection, connection_record):
+    # SQLite only enforces foreign keys when each connection asks for it, as Postgres always does
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+
+def setup_db(app, database_path=database_path, init=DB_INIT):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
-    if not database_exists(database_path):
-        create_database(database_path)
+    app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", engine_options(database_path))
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
     db.app = app
     db.init_app(app)
+    if init:
+        init_db(database_path)
+
+
+"""
+init_db(database_path)
+    creates the database, tables and search indexes that are missing;
+    run once when provisioning (flask init-db) rather than on every start
+"""
+
+
+def init_db(database_path=database_path):
+    # sqlalchemy_utils is slow to import and only needed here
+    from sqlalchemy_utils.functions import database_exists, create_database
+
+    if not database_exists(database_path):
+        create_database(database_path)
     db.create_all()
+    create_search_indexes(db.engine)
+
+
+"""
+create_search_indexes(engine)
+    trigram GIN indexes so the ILIKE '%term%' searches can use an index;
+    skipped (searches fall back to a sequential scan) when pg_trgm is missing
+"""
+
+
+def create_search_indexes(engine):
+    if engine.dialect.name != "postgresql":
+        return
+    try:
+        with engine.begin() as conn:
+            conn.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_questions_question_trgm "
+                         "ON questions USING gin (question gin_trgm_ops)")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_questions_answer_trgm "
+                         "ON questions USING gin (answer gin_trgm_ops)")
+    except Exception as e:
+        logging.getLogger(__name__).warning("search indexes not created: %s", e)
 
 
 """
@@ -31,17 +89,24 @@ Question
 
 class Question(db.Model):
     __tablename__ = 'questions'
+    # (category, id) also serves lookups on category alone;
+    # existing databases get these from migrate_category.py
+    __table_args__ = (
+        Index('ix_questions_category_id', 'category', 'id'),
+        Index('ix_questions_difficulty', 'difficulty'),
+    )
 
     id = Column(Integer, primary_key=True)
     question = Column(String)
     answer = Column(String)
-    category = Column(String)
+    category = Column(Integer, ForeignKey('categories.id', onupdate='CASCADE', ondelete='SET NULL'))
     difficulty = Column(Integer)
 
     def __init__(self, question, answer, category, difficulty):
         self.question = question
         self.answer = answer
-        self.category = category
+        # clients send category ids as strings ("3") as well as integers
+        self.category = int(category)
         self.difficulty = difficulty
 
     def insert(self):
@@ -85,3 +150,41 @@ class Category(db.Model):
             'id': self.id,
             'type': self.type
         }
+
+
+"""
+Score
+    one finished game; category is None for games over all categories
+
+"""
+
+
+class Score(db.Model):
+    __tablename__ = 'scores'
+    # leaderboards are rebuilt from the best scores of each category
+    __table_args__ = (
+        Index('ix_scores_category_score', 'category', 'score'),
+        Index('ix_scores_score', 'score'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    player = Column(String, nullable=False)
+    category = Column(Integer, ForeignKey('categories.id', onupdate='CASCADE', ondelete='SET NULL'))
+    score = Column(Integer, nullable=False)
+    total = Column(Integer)
+    created_at = Column(DateTime, server_default=func.now())
+
+    def __init__(self, player, score, category=None, total=None):
+        self.player = player
+        self.score = score
+        self.category = category
+        self.total = total
+
+    def format(self):
+        return {
+            'id': self.id,
+            'player': self.player,
+            'category': self.category,
+            'score': self.score,
+            'total': self.total
+        }
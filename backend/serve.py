@@ -0,0 +1,132 @@
+"""
+Serves the API from preforked worker processes.
+
+The app is built and its caches (categories, question ids, question count)
+are loaded once in the parent; the workers are forked from it, so imports
+and models are shared copy-on-write and every worker starts warm. From
+then on each worker keeps its own copy of every cache and only sees its
+own writes, so more than one worker needs RESPONSE_CACHE_URL: the shared
+cache carries invalidations between workers, which each one polls (see
+CACHE_SYNC_INTERVAL). Quiz sessions stay per worker. Every worker accepts
+on the same listening socket and runs its own connection pool, opened
+after the fork. Workers that die are replaced; SIGTERM or Ctrl-C stops
+them all, and each writes its queued scores and questions before exiting.
+
+    python serve.py --port 5000
+    RESPONSE_CACHE_URL=redis://localhost:6379/0 python serve.py --port 5000 --workers 4
+
+Startup time per phase and, once the workers are up, each worker's memory
+(RSS, PSS and private bytes from /proc/<pid>/smaps_rollup) are printed.
+GET /ready answers 200 once a worker can serve.
+"""
+import argparse
+import os
+import signal
+import sys
+import time
+
+started = time.perf_counter()
+
+from werkzeug.serving import make_server
+
+from flaskr import create_app
+from models import db
+
+imported = time.perf_counter()
+
+# seconds given to the workers to come up before their memory is reported
+REPORT_DELAY = 1.0
+
+
+def memory(pid):
+    """RSS, PSS and private memory of pid in MB (empty where /proc has no smaps_rollup)."""
+    try:
+        with open('/proc/{}/smaps_rollup'.format(pid)) as f:
+            fields = dict((line.split(':')[0], int(line.split()[1])) for line in f if line.endswith('kB\n'))
+    except OSError:
+        return {}
+    return {'rss': fields['Rss'] / 1024.0, 'pss': fields['Pss'] / 1024.0,
+            'private': (fields['Private_Clean'] + fields['Private_Dirty']) / 1024.0}
+
+
+def spawn(server, app):
+    pid = os.fork()
+    if pid:
+        return pid
+    # a child must never use connections inherited from the parent
+    db.get_engine(app).dispose()
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    code = 0
+    try:
+        server.serve_forever()
+    except SystemExit:
+        pass
+    except Exception:
+        code = 1
+    # os._exit skips atexit, so the write-behind queues are written here
+    try:
+        app.extensions['shutdown']()
+    except Exception:
+        code = 1
+    os._exit(code)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=1,
+                        help='worker processes (default: 1; more need RESPONSE_CACHE_URL)')
+    parser.add_argument('--no-threads', action='store_true', help='serve one request at a time per worker')
+    args = parser.parse_args(argv)
+
+    app = create_app()
+    if args.workers > 1 and not app.extensions['response_cache'].backend.shared:
+        parser.error('--workers above 1 needs RESPONSE_CACHE_URL, or each worker serves stale caches')
+    built = time.perf_counter()
+    with app.app_context():
+        app.extensions['warm_caches']()
+        db.session.remove()
+    # the pool is emptied before forking so no connection is shared between processes
+    db.get_engine(app).dispose()
+    warmed = time.perf_counter()
+
+    server = make_server(args.host, args.port, app, threaded=not args.no_threads)
+    print('startup: import {:.3f}s, create_app {:.3f}s, warm caches {:.3f}s, total {:.3f}s'.format(
+        imported - started, built - imported, warmed - built, time.perf_counter() - started), flush=True)
+    print('listening on http://{}:{} with {} workers'.format(args.host, server.server_port, args.workers), flush=True)
+
+    workers = set(spawn(server, app) for _ in range(args.workers))
+    stopping = []
+
+    def stop(signum, frame):
+        stopping.append(signum)
+        for pid in workers:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    time.sleep(REPORT_DELAY)
+    for pid in sorted(workers):
+        mem = memory(pid)
+        if mem:
+            print('worker {}: rss {rss:.1f}MB, pss {pss:.1f}MB, private {private:.1f}MB'.format(pid, **mem), flush=True)
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except InterruptedError:
+            continue
+        except ChildProcessError:
+            break
+        workers.discard(pid)
+        if not stopping:
+            print('worker {} exited with status {}, restarting'.format(pid, status), flush=True)
+            workers.add(spawn(server, app))
+    server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,34 @@
-from dotenv import load_dotenv
 import os
-load_dotenv()
+
+# .env next to this file fills in settings missing from the environment; python-dotenv
+# is only imported when there is one
+ENV_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env")
+if os.path.exists(ENV_FILE):
+    from dotenv import load_dotenv
+    load_dotenv(ENV_FILE)
 DB_NAME = os.environ.get("DB_NAME")
 DB_USER = os.environ.get("DB_USER")
 DB_PASSWORD = os.environ.get("DB_PASSWORD")
 DB_HOST = os.environ.get("DB_HOST")
 
+# DATABASE_URL overrides the DB_* settings, e.g. sqlite:///trivia_test.db for a local test database
+DATABASE_URL = os.environ.get("DATABASE_URL")
+
 database_name = DB_NAME
-database_domain = DB_USER + ":" + DB_PASSWORD + "@" + DB_HOST
 
 # database_path = 'postgres://{}/{}'.format('localhost:5432', database_name)
-database_path = 'postgres+psycopg2://{}/{}'.format(database_domain, database_name)
+if DATABASE_URL:
+    database_path = DATABASE_URL
+else:
+    database_domain = DB_USER + ":" + DB_PASSWORD + "@" + DB_HOST
+    database_path = 'postgres+psycopg2://{}/{}'.format(database_domain, database_name)
+
+# connection pool used by the single engine created in setup_db
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 20))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+# setup_db creates the database, tables and search indexes only when asked (flask init-db,
+# or DB_INIT=1 to do it on every start); otherwise nothing connects until the first query
+DB_INIT = os.environ.get("DB_INIT", "false").lower() in ("1", "true", "yes")
@@ -1,20 +1,32 @@
+import asyncio
 import datetime
+import gzip
 import os
+import queue
 import unittest
 import json
+import threading
+import time
 
 import flask
 from flask import request
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
 
-from flaskr import create_app
+from flaskr import create_app, bulk, encoding
+from flaskr.asgi import create_asgi_app
 from settings import database_path
-from models import setup_db, Question, Category
+from models import db, setup_db, Question, Category
 
 
 class TriviaTestCase(unittest.TestCase):
     """This class represents the trivia test case"""
 
+    @classmethod
+    def setUpClass(cls):
+        # provision missing tables (e.g. scores) once, like `flask init-db`
+        create_app({'INIT_DB': True})
+
     def setUp(self):
         """Define test variables and initialize app."""
         self.app = create_app()
@@ -49,6 +61,64 @@ class TriviaTestCase(unittest.TestCase):
         info = json.loads(resp.data)
         self.assertEqual(info['Backend_Started'], True)
 
+    def test_ready(self):
+        """Tests the readiness probe loads the caches"""
+
+        resp = self.client().get('/ready')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(json.loads(resp.data)['ready'], True)
+        self.assertEqual(self.app.extensions['category_cache'].stats()['misses'], 1)
+
+    def test_get_categories(self):
+        """Tests the category list and its ETag revalidation"""
+
+        resp = self.client().get('/api/v2.0/categories')
+        info = json.loads(resp.data)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(info['categories'][0], 'Science')
+        self.assertEqual(info['QUESTIONS_PER_PAGE'], 10)
+        self.assertTrue(resp.headers['ETag'])
+
+        # a client holding the current ETag gets a 304 without a body
+        resp = self.client().get('/api/v1.1/categories', headers={'If-None-Match': resp.headers['ETag']})
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.data, b'')
+
+    def test_categories_loaded_once(self):
+        """Tests the category cache serves repeated requests without reloading"""
+
+        # with the response cache on, repeats would not reach the category cache at all
+        app = create_app({'RESPONSE_CACHE': False})
+        for _ in range(3):
+            app.test_client().get('/api/v1.1/categories')
+        stats = app.extensions['category_cache'].stats()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 2)
+
+    def test_server_timing_and_metrics(self):
+        """Tests requests report their DB and serialization time and show up in /metrics"""
+
+        resp = self.client().get('/api/v1.0/questions?page=1')
+        self.assertIn('db;dur=', resp.headers['Server-Timing'])
+        self.assertIn('serialize;dur=', resp.headers['Server-Timing'])
+
+        resp = self.client().get('/metrics')
+        self.assertEqual(resp.status_code, 200)
+        body = resp.data.decode('utf-8')
+        self.assertIn('trivia_request_duration_seconds_count{endpoint="list_que"} 1', body)
+        self.assertIn('trivia_db_queries_total{endpoint="list_que"}', body)
+
+    def test_profile_is_opt_in(self):
+        """Tests ?profile=1 only returns a cProfile summary when ALLOW_PROFILING is set"""
+
+        resp = self.client().get('/api/v1.0/questions?page=1&profile=1')
+        self.assertEqual(json.loads(resp.data)['success'], True)
+
+        client = create_app({'ALLOW_PROFILING': True}).test_client
+        resp = client().get('/api/v1.0/questions?page=1&profile=1')
+        self.assertEqual(resp.mimetype, 'text/plain')
+        self.assertIn('function calls', resp.data.decode('utf-8'))
+
     def test_get_paginated_questions(self):
         """Tests question pagination success"""
 
@@ -69,6 +139,342 @@ class TriviaTestCase(unittest.TestCase):
         #self.assertGreaterEqual(len(info['questions']), 1)
         self.assertEqual(len(info['questions']), 0)
 
+    def test_get_questions_after_id(self):
+        """Tests keyset pagination returns the same rows as page 2"""
+
+        page_1 = json.loads(self.client().get('/api/v1.0/questions?page=1').data)
+        page_2 = json.loads(self.client().get('/api/v1.0/questions?page=2').data)
+        resp = self.client().get('/api/v1.0/questions?after_id={}'.format(page_1['next_after_id']))
+        info = json.loads(resp.data)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(info['success'], True)
+        # the cursor page matches the offset page and the total comes from COUNT
+        self.assertEqual(info['questions'], page_2['questions'])
+        self.assertEqual(info['total_questions'], len(Question.query.all()))
+
+    def test_get_questions_compact(self):
+        """Tests ?compact=1 leaves out the categories and page size"""
+
+        full = json.loads(self.client().get('/api/v1.0/questions?page=1').data)
+        info = json.loads(self.client().get('/api/v1.0/questions?page=1&compact=1').data)
+        self.assertNotIn('categories', info)
+        self.assertNotIn('QUESTIONS_PER_PAGE', info)
+        self.assertEqual(info['questions'], full['questions'])
+        self.assertEqual(info['total_questions'], full['total_questions'])
+
+    def test_total_questions_after_create(self):
+        """Tests the cached question count is invalidated by a write"""
+
+        before = json.loads(self.client().get('/api/v1.0/questions?page=1').data)
+        self.client().post('/api/v2.0/questions', json=self.new_question)
+        after = json.loads(self.client().get('/api/v1.0/questions?page=1').data)
+        self.assertEqual(after['total_questions'] - before['total_questions'], 1)
+
+    def test_response_cache(self):
+        """Tests repeated reads are served from the response cache until a question changes"""
+
+        first = self.client().get('/api/v1.0/questions?page=1')
+        resp = self.client().get('/api/v1.0/questions?page=1')
+        self.assertEqual(resp.data, first.data)
+        self.assertTrue(resp.headers['ETag'])
+        self.assertTrue(resp.headers['Last-Modified'])
+        self.assertEqual(self.app.extensions['response_cache'].stats()['hits'], 1)
+
+        resp = self.client().get('/api/v1.0/questions?page=1', headers={'If-None-Match': resp.headers['ETag']})
+        self.assertEqual(resp.status_code, 304)
+
+        # repeated search terms are cached too
+        self.client().post('/api/v3.0/questions', json={'searchTerm': 'title'})
+        self.client().post('/api/v3.0/questions', json={'searchTerm': 'title'})
+        self.assertEqual(self.app.extensions['response_cache'].stats()['hits'], 3)
+
+        # writing a question drops every cached question listing
+        created = json.loads(self.client().post('/api/v2.0/questions', json=self.new_question).data)['created']
+        info = json.loads(self.client().get('/api/v1.0/questions?page=1').data)
+        self.assertEqual(info['total_questions'], json.loads(first.data)['total_questions'] + 1)
+        self.client().delete('/api/v1.0/questions/{}'.format(created))
+        info = json.loads(self.client().get('/api/v1.0/questions?page=1').data)
+        self.assertEqual(info['total_questions'], json.loads(first.data)['total_questions'])
+
+    def test_response_cache_categories(self):
+        """Tests each category's cached listing holds that category's questions"""
+
+        for _ in range(2):
+            for cat in (0, 1):
+                info = json.loads(self.client().get('/api/v1.0/categories/{}/questions'.format(cat)).data)
+                self.assertEqual(info['success'], True)
+                self.assertTrue(all(q['category'] == cat + 1 for q in info['questions']))
+        self.assertEqual(self.app.extensions['response_cache'].stats()['hits'], 2)
+
+    def test_response_cache_ttl(self):
+        """Tests cached responses older than RESPONSE_CACHE_TTL are rebuilt"""
+
+        app = create_app({'RESPONSE_CACHE_TTL': 0.2})
+        for _ in range(2):
+            app.test_client().get('/api/v1.0/questions?page=1')
+        self.assertEqual(app.extensions['response_cache'].stats()['hits'], 1)
+        time.sleep(0.3)
+        app.test_client().get('/api/v1.0/questions?page=1')
+        stats = app.extensions['response_cache'].stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 2))
+
+    def test_shared_cache_sync(self):
+        """Tests a write in one process reaches the in-memory caches of another through the shared cache"""
+
+        first, second = [create_app({'CACHE_SYNC_INTERVAL': 0}) for _ in range(2)]
+        # stands in for the Redis backend both processes would share
+        shared = first.extensions['response_cache'].backend
+        shared.shared = True
+        for app in (first, second):
+            app.extensions['response_cache'].backend = shared
+        before = json.loads(second.test_client().get('/api/v1.0/questions?page=1').data)['total_questions']
+        created = json.loads(first.test_client().post('/api/v2.0/questions', json=self.new_question).data)['created']
+        try:
+            info = json.loads(second.test_client().get('/api/v1.0/questions?page=1').data)
+            self.assertEqual(info['total_questions'], before + 1)
+            info = json.loads(second.test_client().get('/api/v1.1/stats').data)
+            self.assertEqual(info['total_questions'], before + 1)
+        finally:
+            first.test_client().delete('/api/v1.0/questions/{}'.format(created))
+        info = json.loads(second.test_client().get('/api/v1.0/questions?page=1').data)
+        self.assertEqual(info['total_questions'], before)
+
+    def test_question_cache_ttl(self):
+        """Tests rows loaded behind the app's back (import CLI, psql) reach its caches after QUESTION_CACHE_TTL"""
+
+        client = create_app({'QUESTION_CACHE_TTL': 0, 'RESPONSE_CACHE': False}).test_client
+        text = 'Loaded by hand {}'.format(os.getpid())
+        before = json.loads(client().get('/api/v1.0/questions?page=1').data)['total_questions']
+        client().get('/api/v3.0/questions/autocomplete?q=Loaded')
+
+        def remove():
+            Question.query.filter_by(question=text).delete()
+            db.session.commit()
+
+        self.addCleanup(remove)
+        Question(question=text, answer='yes', category=1, difficulty=1).insert()
+        info = json.loads(client().get('/api/v1.0/questions?page=1').data)
+        self.assertEqual(info['total_questions'], before + 1)
+        info = json.loads(client().get('/api/v1.1/stats').data)
+        self.assertEqual(info['total_questions'], before + 1)
+        info = json.loads(client().get('/api/v3.0/questions/autocomplete?q=Loaded').data)
+        self.assertIn(text, [s['question'] for s in info['suggestions']])
+
+        remove()
+        info = json.loads(client().get('/api/v1.0/questions?page=1').data)
+        self.assertEqual(info['total_questions'], before)
+
+    def test_response_cache_byte_budget(self):
+        """Tests the response cache evicts the least recently used entries past its byte budget"""
+
+        app = create_app({'RESPONSE_CACHE_BYTES': 4 * 1024})
+        for page in (1, 2, 3, 4, 1):
+            app.test_client().get('/api/v1.0/questions?page={}'.format(page))
+        stats = app.extensions['response_cache'].stats()
+        self.assertLessEqual(stats['bytes'], 4 * 1024)
+        self.assertGreater(stats['evictions'], 0)
+
+    def test_compressed_responses(self):
+        """Tests large responses are gzipped for clients that accept it, from the cache too"""
+
+        url = '/api/v1.0/questions?page=1'
+        plain = self.client().get(url)
+        self.assertNotIn('Content-Encoding', plain.headers)
+        for _ in range(2):
+            resp = self.client().get(url, headers={'Accept-Encoding': 'gzip'})
+            self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+            self.assertIn('Accept-Encoding', resp.headers['Vary'])
+            self.assertEqual(gzip.decompress(resp.data), plain.data)
+        self.assertEqual(self.app.extensions['response_cache'].stats()['hits'], 2)
+
+        # the compressed body's weak ETag still revalidates
+        resp = self.client().get(url, headers={'Accept-Encoding': 'gzip', 'If-None-Match': resp.headers['ETag']})
+        self.assertEqual(resp.status_code, 304)
+
+        # small bodies and uncached endpoints
+        resp = self.client().get('/api/v2.0/categories', headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', resp.headers)
+        resp = create_app({'RESPONSE_CACHE': False}).test_client().get(url, headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(gzip.decompress(resp.data), plain.data)
+
+    def test_json_encoders_match(self):
+        """Tests responses without floats are byte-identical with and without orjson, non-ASCII text included"""
+
+        que = dict(self.new_question, question='Où se trouve 東京?', answer='Japon')
+        created = json.loads(self.client().post('/api/v2.0/questions', json=que).data)['created']
+        bodies = []
+        try:
+            for fast in (encoding.orjson is not None, False):
+                encoding.fast_json = fast
+                bodies.append(self.client().post('/api/v2.0/questions/batch', json={'ids': [created]}).data)
+                bodies.append(create_app({'QUESTION_STORE': True}).test_client().get(
+                    '/api/v1.0/questions?after_id={}'.format(created - 1)).data)
+        finally:
+            encoding.fast_json = encoding.orjson is not None
+            self.client().delete('/api/v1.0/questions/{}'.format(created))
+        self.assertEqual(bodies[:2], bodies[2:])
+        self.assertIn(b'\\u6771\\u4eac', bodies[0])
+        self.assertEqual(json.loads(bodies[0])['questions'][0]['question'], que['question'])
+
+    def test_asgi_serves_same_contract(self):
+        """Tests the ASGI mode answers concurrent requests like the WSGI app"""
+
+        asgi_app = create_asgi_app(max_workers=4)
+
+        async def call(method, path, body=None):
+            messages = []
+            payload = json.dumps(body).encode('utf-8') if body is not None else b''
+            path, _, query = path.partition('?')
+            scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query.encode('latin-1'),
+                     'headers': [(b'content-type', b'application/json')]}
+
+            async def receive():
+                return {'type': 'http.request', 'body': payload, 'more_body': False}
+
+            async def send(message):
+                messages.append(message)
+
+            await asgi_app(scope, receive, send)
+            return messages[0]['status'], b''.join(m.get('body', b'') for m in messages[1:])
+
+        async def run():
+            return await asyncio.gather(*[call('GET', '/api/v1.0/questions?page={}'.format(i % 3 + 1))
+                                          for i in range(20)],
+                                        call('POST', '/api/v3.0/questions', {'searchTerm': 'title'}))
+
+        results = asyncio.run(run())
+        for i, (status, body) in enumerate(results[:20]):
+            self.assertEqual(status, 200)
+            expected = self.client().get('/api/v1.0/questions?page={}'.format(i % 3 + 1))
+            self.assertEqual(json.loads(body), json.loads(expected.data))
+        status, body = results[20]
+        self.assertEqual(json.loads(body)['success'], True)
+
+    def test_question_store(self):
+        """Tests the in-memory question store serves the same listings and follows writes"""
+
+        client = create_app({'QUESTION_STORE': True, 'RESPONSE_CACHE': False}).test_client
+        for path in ('/api/v1.0/questions?page=2', '/api/v1.0/questions?after_id=5',
+                     '/api/v1.0/categories/0/questions', '/api/v1.0/categories/1/questions'):
+            self.assertEqual(json.loads(client().get(path).data), json.loads(self.client().get(path).data))
+
+        created = json.loads(client().post('/api/v2.0/questions', json=self.new_question).data)['created']
+        info = json.loads(client().get('/api/v1.0/categories/2/questions').data)
+        self.assertIn(created, [q['id'] for q in info['questions']])
+        client().delete('/api/v1.0/questions/{}'.format(created))
+        info = json.loads(client().get('/api/v1.0/categories/2/questions').data)
+        self.assertNotIn(created, [q['id'] for q in info['questions']])
+
+    def test_identical_requests_coalesced(self):
+        """Tests identical concurrent calls run once and all get the result"""
+
+        flight = self.app.extensions['single_flight']
+        release = threading.Event()
+        calls, results = [], []
+
+        def query():
+            calls.append(1)
+            release.wait(5)
+            return 'rows'
+
+        threads = [threading.Thread(target=lambda: results.append(flight.do('key', query))) for _ in range(5)]
+        threads[0].start()
+        while not calls:
+            release.wait(0.01)
+        for t in threads[1:]:
+            t.start()
+        while flight.coalesced < 4:
+            release.wait(0.01)
+        release.set()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['rows'] * 5)
+
+    def test_concurrent_categories_not_coalesced(self):
+        """Tests concurrent listings of different categories each run and get their own questions"""
+
+        app = create_app({'RESPONSE_CACHE': False})
+        flight = app.extensions['single_flight']
+        do = flight.do
+        release = threading.Event()
+        entered, results = [], {}
+
+        def held(key, fn):
+            def run():
+                entered.append(key)
+                release.wait(5)
+                return fn()
+            return do(key, run)
+
+        flight.do = held
+
+        def listing(cat):
+            info = json.loads(app.test_client().get('/api/v1.0/categories/{}/questions'.format(cat)).data)
+            results[cat] = info
+
+        threads = [threading.Thread(target=listing, args=(cat,)) for cat in (0, 1)]
+        for t in threads:
+            t.start()
+        while len(entered) < 2 and flight.coalesced < 1:
+            release.wait(0.01)
+        release.set()
+        for t in threads:
+            t.join()
+        self.assertEqual(flight.coalesced, 0)
+        for cat in (0, 1):
+            self.assertTrue(all(q['category'] == cat + 1 for q in results[cat]['questions']))
+
+    def test_rate_limit(self):
+        """Tests a client past its burst is throttled with a 429 and counted in /metrics"""
+
+        client = create_app({'RATE_LIMIT': True, 'RATE_LIMITS': {'search_by_que': (1, 2)},
+                             'RATE_LIMIT_CLIENT_HEADER': 'X-Forwarded-For'}).test_client
+        first = {'X-Forwarded-For': '10.0.0.1, 192.168.0.1'}
+        codes = [client().post('/api/v3.0/questions', json={'searchTerm': 'title'}, headers=first).status_code
+                 for _ in range(3)]
+        self.assertEqual(codes, [200, 200, 429])
+        # other endpoints and other clients have their own buckets
+        self.assertEqual(client().get('/api/v1.0/categories/0/questions', headers=first).status_code, 200)
+        resp = client().post('/api/v3.0/questions', json={'searchTerm': 'title'},
+                             headers={'X-Forwarded-For': '10.0.0.2'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('trivia_throttled_requests_total 1', client().get('/metrics').data.decode())
+
+    def test_concurrent_requests(self):
+        """Tests concurrent requests each check out their own pooled session"""
+
+        errors = []
+        # counted through pool events, which every pool fires (SQLite files get a NullPool)
+        engine = db.get_engine(self.app)
+        connections = {'checkout': 0, 'checkin': 0}
+
+        def count(name):
+            def listener(*args):
+                connections[name] += 1
+            event.listen(engine, name, listener)
+            self.addCleanup(event.remove, engine, name, listener)
+
+        count('checkout')
+        count('checkin')
+
+        def read_pages():
+            client = self.app.test_client()
+            for page in range(1, 4):
+                info = json.loads(client.get('/api/v1.0/questions?page={}'.format(page)).data)
+                if not info['success']:
+                    errors.append(info)
+
+        threads = [threading.Thread(target=read_pages) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+        # every session was returned to the pool by teardown_appcontext
+        self.assertGreater(connections['checkout'], 0)
+        self.assertEqual(connections['checkout'], connections['checkin'])
+
     def test_delete_question(self):
         """Tests question deletion success"""
 
@@ -97,6 +503,38 @@ class TriviaTestCase(unittest.TestCase):
         # check if question equals None after delete
         self.assertEqual(question, None)
 
+    def test_fetch_questions_batch(self):
+        """Tests fetching questions by id list, in request order, with the missing ids reported"""
+
+        resp = self.client().post('/api/v2.0/questions/batch', json={'ids': [5, 2, 5, 999999]})
+        info = json.loads(resp.data)
+        self.assertEqual(info['success'], True)
+        self.assertEqual([q['id'] for q in info['questions']], [5, 2])
+        self.assertEqual(info['missing'], [999999])
+
+        for ids in (list(range(501)), [1.7, True], ['5'], [None]):
+            info = json.loads(self.client().post('/api/v2.0/questions/batch', json={'ids': ids}).data)
+            self.assertEqual(info['success'], False)
+            self.assertEqual(info['message'], 'bad request')
+
+    def test_delete_questions_batch(self):
+        """Tests deleting an id list in one request with a result per id"""
+
+        ids = []
+        for _ in range(3):
+            question = Question(**self.new_question)
+            question.insert()
+            ids.append(question.id)
+        resp = self.client().delete('/api/v2.0/questions/batch', json={'ids': ids + [999999]})
+        info = json.loads(resp.data)
+        self.assertEqual(info['success'], True)
+        self.assertEqual(info['deleted'], 3)
+        self.assertEqual(info['results'][-1], {'id': 999999, 'deleted': False})
+        self.assertEqual(Question.query.filter(Question.id.in_(ids)).count(), 0)
+
+        info = json.loads(self.client().delete('/api/v2.0/questions/batch', json={'ids': 'all'}).data)
+        self.assertEqual(info['success'], False)
+
     def test_delete_question_failure(self):
         """Tests question deletion failure"""
 
@@ -141,6 +579,160 @@ class TriviaTestCase(unittest.TestCase):
         # check that question is not None
         self.assertIsNotNone(question)
 
+    def test_create_questions_write_behind(self):
+        """Tests write-behind inserts concurrent questions in group commits and acks each with its id"""
+
+        app = create_app({'WRITE_BEHIND': True, 'WRITE_BEHIND_DELAY_MS': 200})
+        results = []
+
+        def submit():
+            resp = app.test_client().post('/api/v2.0/questions', json=self.new_question)
+            results.append(json.loads(resp.data))
+
+        threads = [threading.Thread(target=submit) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        ids = [r['created'] for r in results]
+        self.assertTrue(all(r['success'] for r in results))
+        self.assertEqual(len(set(ids)), 8)
+        self.assertEqual(Question.query.filter(Question.id.in_(ids)).count(), 8)
+        stats = app.extensions['question_writer'].stats()
+        self.assertEqual(stats['rows'], 8)
+        self.assertLess(stats['batches'], 8)
+        self.assertIn('trivia_question_writer_queue_depth 0', app.test_client().get('/metrics').data.decode())
+
+        info = json.loads(app.test_client().post('/api/v2.0/questions', json=dict(self.new_question, category=99)).data)
+        self.assertEqual(info['success'], False)
+        app.test_client().delete('/api/v2.0/questions/batch', json={'ids': ids})
+
+    def test_create_question_write_behind_timeout(self):
+        """Tests a write-behind timeout cancels a queued question but reports one being written as pending"""
+
+        # still waiting for its group when the timeout passes: cancelled and never written
+        app = create_app({'WRITE_BEHIND': True, 'WRITE_BEHIND_DELAY_MS': 200, 'WRITE_BEHIND_TIMEOUT': 0.05})
+        # the writer threads and this thread's session must not hold the database for the next test
+        self.addCleanup(db.session.remove)
+        self.addCleanup(app.extensions['shutdown'])
+        que = dict(self.new_question, question='Write-behind timeout {}'.format(os.getpid()))
+        info = json.loads(app.test_client().post('/api/v2.0/questions', json=que).data)
+        self.assertEqual(info, {'success': False, 'message': 'timed out'})
+
+        def stored():
+            # built on every use: each test client request removes this thread's session
+            return Question.query.filter(Question.question == que['question'])
+
+        def remove():
+            stored().delete(synchronize_session=False)
+            db.session.commit()
+
+        self.addCleanup(remove)
+        threading.Event().wait(0.3)
+        self.assertEqual(app.extensions['question_writer'].stats()['rows'], 0)
+        self.assertEqual(stored().count(), 0)
+
+        # already being written when the timeout passes: accepted, and it does commit
+        app = create_app({'WRITE_BEHIND': True, 'WRITE_BEHIND_DELAY_MS': 0, 'WRITE_BEHIND_TIMEOUT': 0.05})
+        self.addCleanup(app.extensions['shutdown'])
+        writer = app.extensions['question_writer']
+        release = threading.Event()
+        flush = writer.flush
+        writer.flush = lambda rows: release.wait(5) and flush(rows)
+        resp = app.test_client().post('/api/v2.0/questions', json=que)
+        self.assertEqual(resp.status_code, 202)
+        self.assertEqual(json.loads(resp.data), {'success': True, 'pending': True})
+        release.set()
+        while writer.stats()['rows'] < 1:
+            release.wait(0.01)
+        self.assertEqual(stored().count(), 1)
+
+    def test_question_stats(self):
+        """Tests the per-category counts follow creates, deletes and bulk loads and match a recount"""
+
+        def science():
+            info = json.loads(self.client().get('/api/v1.1/stats').data)
+            return info, [c for c in info['categories'] if c['type'] == 'Science'][0]
+
+        info, before = science()
+        self.assertEqual(info['total_questions'], sum(c['total'] for c in info['categories']))
+
+        created = json.loads(self.client().post('/api/v2.0/questions', json=dict(self.new_question, category=1,
+                                                                                  difficulty=5)).data)['created']
+        info, after = science()
+        self.assertEqual(after['total'], before['total'] + 1)
+        self.assertEqual(after['difficulties']['5'], before['difficulties'].get('5', 0) + 1)
+
+        self.client().post('/api/v2.0/questions/bulk', data=json.dumps(dict(self.new_question, category=1)),
+                           content_type='application/x-ndjson')
+        self.assertEqual(science()[1]['total'], before['total'] + 2)
+
+        self.client().delete('/api/v1.0/questions/{}'.format(created))
+        info, after = science()
+        self.assertEqual(after['total'], before['total'] + 1)
+        recount = json.loads(self.client().get('/api/v1.1/stats?recompute=1').data)
+        self.assertEqual(recount['categories'], info['categories'])
+        self.assertEqual(recount['difficulties'], info['difficulties'])
+
+    def test_bulk_import_and_export(self):
+        """Tests bulk NDJSON import reports batches and rejects, and the export streams it back"""
+
+        rows = [dict(self.new_question, question='Bulk question {}'.format(i)) for i in range(3)]
+        body = '\n'.join([json.dumps(r) for r in rows] + ['{"question": "no answer"}'])
+        resp = self.client().post('/api/v2.0/questions/bulk', data=body, content_type='application/x-ndjson')
+        info = json.loads(resp.data)
+        self.assertEqual(info['success'], True)
+        self.assertEqual(info['inserted'], 3)
+        self.assertEqual(info['rejected'], 1)
+        self.assertEqual(info['errors'][0]['row'], 4)
+        self.assertEqual(sum(b['rows'] for b in info['batches']), 3)
+
+        resp = self.client().get('/api/v2.0/questions/export')
+        exported = [json.loads(line) for line in resp.data.decode('utf-8').splitlines()]
+        self.assertEqual(len(exported), len(Question.query.all()))
+        self.assertEqual([q['question'] for q in exported[-3:]], [r['question'] for r in rows])
+
+    def test_bulk_import_partial_failure(self):
+        """Tests a batch that fails to insert stops the import and the report keeps the committed batches"""
+
+        prefix = 'Partial import {} '.format(os.getpid())
+        rows = [dict(self.new_question, question=prefix + str(i)) for i in range(4)]
+        # passes validation but breaks the foreign key, so the second batch fails in the database
+        rows[3]['category'] = 999
+
+        def cleanup():
+            with self.app.app_context():
+                Question.query.filter(Question.question.startswith(prefix)).delete(synchronize_session=False)
+                db.session.commit()
+
+        self.addCleanup(cleanup)
+        with self.app.app_context():
+            report = bulk.import_rows(db.session, Question, rows, lambda c: True, batch_size=2)
+            self.assertEqual(report['inserted'], 2)
+            self.assertEqual((report['failed']['batch'], report['failed']['row']), (2, 4))
+            self.assertEqual(Question.query.filter(Question.question.startswith(prefix)).count(), 2)
+
+    def test_bulk_import_csv(self):
+        """Tests bulk CSV import validates the category"""
+
+        body = 'question,answer,category,difficulty\nCSV question,CSV answer,3,2\nBad category,x,100,2\n'
+        resp = self.client().post('/api/v2.0/questions/bulk', data=body, content_type='text/csv')
+        info = json.loads(resp.data)
+        self.assertEqual(info['inserted'], 1)
+        self.assertEqual(info['errors'], [{'row': 2, 'error': 'unknown category 100'}])
+
+    def test_create_question_with_string_category(self):
+        """Tests string category ids are still accepted and stored as the integer key"""
+
+        resp = self.client().post('/api/v2.0/questions', json=self.new_question)
+        info = json.loads(resp.data)
+        self.assertEqual(info['success'], True)
+        question = Question.query.filter_by(id=info['created']).one()
+        self.assertEqual(question.category, 3)
+
+        resp = self.client().post('/api/v2.0/questions', json=dict(self.new_question, category='three'))
+        self.assertEqual(json.loads(resp.data)['success'], False)
+
     def test_422_if_question_creation_fails(self):
         """Tests question creation failure 422"""
 
@@ -185,6 +777,59 @@ class TriviaTestCase(unittest.TestCase):
         #self.assertEqual(response.status_code, 404)
         self.assertEqual(info['success'], False)
         self.assertEqual(info['message'], 'resource not found')
+    def test_search_questions_ranked_and_paged(self):
+        """Tests search ranks whole-word matches first and pages results"""
+
+        resp = self.client().post('/api/v3.0/questions', json={'searchTerm': 'title'})
+        info = json.loads(resp.data)
+        # 'title' is a word of question 6 and only a substring ('entitled') of question 5
+        self.assertEqual([q['id'] for q in info['questions']][:2], [6, 5])
+
+        resp = self.client().post('/api/v3.0/questions', json={'searchTerm': 'the', 'page': 2})
+        info = json.loads(resp.data)
+        self.assertEqual(info['success'], True)
+        self.assertGreater(info['total_questions'], 10)
+        self.assertEqual(len(info['questions']), min(10, info['total_questions'] - 10))
+
+    def test_search_questions_bad_page(self):
+        """Tests search rejects pages that are not integers of at least 1"""
+
+        for page in (0, -1, 'x', 1.5, True):
+            resp = self.client().post('/api/v3.0/questions', json={'searchTerm': 'the', 'page': page})
+            info = json.loads(resp.data)
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(info['success'], False)
+            self.assertEqual(info['message'], 'bad request')
+
+    def test_search_answers(self):
+        """Tests searchAnswers also matches answer text and wildcards are literal"""
+
+        resp = self.client().post('/api/v3.0/questions', json={'searchTerm': 'Tom Cruise'})
+        self.assertEqual(json.loads(resp.data)['success'], False)
+        resp = self.client().post('/api/v3.0/questions', json={'searchTerm': 'Tom Cruise', 'searchAnswers': True})
+        info = json.loads(resp.data)
+        self.assertEqual(info['success'], True)
+        self.assertEqual(info['questions'][0]['answer'], 'Tom Cruise')
+
+        resp = self.client().post('/api/v3.0/questions', json={'searchTerm': '%'})
+        self.assertEqual(json.loads(resp.data)['success'], False)
+
+    def test_autocomplete_questions(self):
+        """Tests prefix suggestions, including questions created afterwards"""
+
+        resp = self.client().get('/api/v3.0/questions/autocomplete?q=tit')
+        info = json.loads(resp.data)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual([s['id'] for s in info['suggestions']], [6])
+
+        question = dict(self.new_question, question='Xylophone-{} is tuned how?'.format(os.getpid()))
+        created = json.loads(self.client().post('/api/v2.0/questions', json=question).data)['created']
+        info = json.loads(self.client().get('/api/v3.0/questions/autocomplete?q=xylophone-{}'.format(os.getpid())).data)
+        self.assertEqual([s['id'] for s in info['suggestions']], [created])
+        self.client().delete('/api/v1.0/questions/{}'.format(created))
+        info = json.loads(self.client().get('/api/v3.0/questions/autocomplete?q=xylophone-{}'.format(os.getpid())).data)
+        self.assertEqual(info['suggestions'], [])
+
     def test_get_questions_by_category(self):
         """Tests getting questions by category success"""
 
@@ -200,6 +845,26 @@ class TriviaTestCase(unittest.TestCase):
         # check that current category returned is science
         self.assertEqual(info['current_category'], 'Science')
 
+    def test_get_questions_by_category_streamed(self):
+        """Tests ?stream=1 and NDJSON return the same questions as the buffered response"""
+
+        buffered = json.loads(self.client().get('/api/v1.0/categories/0/questions').data)
+        resp = self.client().get('/api/v1.0/categories/0/questions?stream=1')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(json.loads(resp.data), buffered)
+
+        resp = self.client().get('/api/v1.0/categories/0/questions', headers={'Accept': 'application/x-ndjson'})
+        self.assertEqual(resp.mimetype, 'application/x-ndjson')
+        lines = [json.loads(line) for line in resp.data.decode('utf-8').splitlines()]
+        self.assertEqual(lines, buffered['questions'])
+
+    def test_search_questions_streamed(self):
+        """Tests a streamed search matches the buffered one"""
+
+        buffered = json.loads(self.client().post('/api/v3.0/questions', json={'searchTerm': 'the'}).data)
+        resp = self.client().post('/api/v3.0/questions?stream=1', json={'searchTerm': 'the'})
+        self.assertEqual(json.loads(resp.data), buffered)
+
     def test_400_if_questions_by_category_fails(self):
         """Tests getting questions by category failure 400"""
 
@@ -233,6 +898,255 @@ class TriviaTestCase(unittest.TestCase):
         self.assertNotEqual(info['question']['id'], 20)
         self.assertNotEqual(info['question']['id'], 21)
 
+    def test_play_quiz_last_unseen_question(self):
+        """Tests the quiz draws the only question not yet played"""
+
+        questions = json.loads(self.client().get('/api/v1.0/categories/0/questions').data)['questions']
+        ids = [q['id'] for q in questions]
+        resp = self.client().post('/api/v1.1/quizzes',
+                                      json={'previous_questions': ids[:-1], 'questionsPerPlay': 5,
+                                            'quiz_category': {'type': 'Science', 'id': '0'}})
+        info = json.loads(resp.data)
+        self.assertEqual(info['success'], True)
+        self.assertEqual(info['question']['id'], ids[-1])
+
+        # once every question was played the category size is returned instead
+        resp = self.client().post('/api/v1.1/quizzes',
+                                      json={'previous_questions': ids, 'questionsPerPlay': 5,
+                                            'quiz_category': {'type': 'Science', 'id': '0'}})
+        info = json.loads(resp.data)
+        self.assertNotIn('question', info)
+        self.assertEqual(info['total_que_answered'], len(ids))
+
+    def test_play_quiz_sees_new_question(self):
+        """Tests a question created through the API can be drawn right away"""
+
+        ids = [q.id for q in Question.query.all()]
+        # warm the index before the write so the test covers the incremental update
+        self.client().post('/api/v1.1/quizzes',
+                           json={'previous_questions': [], 'questionsPerPlay': 5,
+                                 'quiz_category': {'type': 'all', 'id': 'all'}})
+        created = json.loads(self.client().post('/api/v2.0/questions', json=self.new_question).data)['created']
+        resp = self.client().post('/api/v1.1/quizzes',
+                                      json={'previous_questions': ids, 'questionsPerPlay': 5,
+                                            'quiz_category': {'type': 'all', 'id': 'all'}})
+        info = json.loads(resp.data)
+        self.assertEqual(info['question']['id'], created)
+
+    def test_play_quiz_session(self):
+        """Tests a quiz session serves distinct questions until questionsPerPlay"""
+
+        resp = self.client().post('/api/v1.1/quizzes/sessions',
+                                  json={'questionsPerPlay': 3, 'quiz_category': {'type': 'Science', 'id': '0'}})
+        info = json.loads(resp.data)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(info['success'], True)
+        token = info['token']
+
+        seen = []
+        for _ in range(3):
+            info = json.loads(self.client().post('/api/v1.1/quizzes/sessions/{}'.format(token)).data)
+            self.assertEqual(info['question']['category'], 1)
+            seen.append(info['question']['id'])
+        self.assertEqual(len(set(seen)), 3)
+
+        info = json.loads(self.client().post('/api/v1.1/quizzes/sessions/{}'.format(token)).data)
+        self.assertNotIn('question', info)
+        self.assertEqual(info['total_que_answered'], 3)
+
+        info = json.loads(self.client().delete('/api/v1.1/quizzes/sessions/{}'.format(token)).data)
+        self.assertEqual(info['success'], True)
+
+    def test_play_quiz_session_evicted(self):
+        """Tests sessions past QUIZ_SESSION_MAX are evicted"""
+
+        client = create_app({'QUIZ_SESSION_MAX': 1}).test_client
+        body = {'quiz_category': {'type': 'all', 'id': 'all'}}
+        first = json.loads(client().post('/api/v1.1/quizzes/sessions', json=body).data)['token']
+        client().post('/api/v1.1/quizzes/sessions', json=body)
+        info = json.loads(client().post('/api/v1.1/quizzes/sessions/{}'.format(first)).data)
+        self.assertEqual(info['success'], False)
+        self.assertEqual(info['message'], 'resource not found')
+
+        # past QUIZ_SESSION_MAX_IDS served ids the least recently used session goes
+        client = create_app({'QUIZ_SESSION_MAX_IDS': 2}).test_client
+        first, second = [json.loads(client().post('/api/v1.1/quizzes/sessions', json=body).data)['token']
+                         for _ in range(2)]
+        client().post('/api/v1.1/quizzes/sessions/{}'.format(first))
+        client().post('/api/v1.1/quizzes/sessions/{}'.format(second))
+        info = json.loads(client().post('/api/v1.1/quizzes/sessions/{}'.format(second)).data)
+        self.assertEqual(info['success'], True)
+        info = json.loads(client().post('/api/v1.1/quizzes/sessions/{}'.format(first)).data)
+        self.assertEqual(info['message'], 'resource not found')
+
+    def test_play_quiz_session_concurrent(self):
+        """Tests concurrent turns of one session never serve the same question twice"""
+
+        body = {'questionsPerPlay': 8, 'quiz_category': {'type': 'all', 'id': 'all'}}
+        token = json.loads(self.client().post('/api/v1.1/quizzes/sessions', json=body).data)['token']
+        served = []
+
+        def play():
+            info = json.loads(self.client().post('/api/v1.1/quizzes/sessions/{}'.format(token)).data)
+            served.append(info['question']['id'])
+
+        threads = [threading.Thread(target=play) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(set(served)), 8)
+        info = json.loads(self.client().post('/api/v1.1/quizzes/sessions/{}'.format(token)).data)
+        self.assertEqual(info['total_que_answered'], 8)
+
+    def test_play_quiz_by_difficulty(self):
+        """Tests a target difficulty draws from that difficulty while it has unseen questions"""
+
+        body = {'previous_questions': [], 'questionsPerPlay': 5, 'quiz_category': {'type': 'all', 'id': 'all'},
+                'difficulty': 4}
+        info = json.loads(self.client().post('/api/v1.1/quizzes', json=body).data)
+        self.assertEqual(info['question']['difficulty'], 4)
+
+        # a score of 0 (no right answers yet) asks for the easiest questions
+        body = dict(body, difficulty=None, score=0.0)
+        info = json.loads(self.client().post('/api/v1.1/quizzes', json=body).data)
+        self.assertEqual(info['question']['difficulty'], 1)
+
+    def test_play_quiz_adaptive_session(self):
+        """Tests an adaptive session raises the difficulty after right answers and lowers it after wrong ones"""
+
+        body = {'quiz_category': {'type': 'all', 'id': 'all'}, 'adaptive': True, 'difficulty': 2}
+        info = json.loads(self.client().post('/api/v1.1/quizzes/sessions', json=body).data)
+        token = info['token']
+        self.assertEqual(info['difficulty'], 2)
+
+        url = '/api/v1.1/quizzes/sessions/{}'.format(token)
+        info = json.loads(self.client().post(url).data)
+        self.assertEqual(info['question']['difficulty'], 2)
+        info = json.loads(self.client().post(url, json={'correct': True}).data)
+        self.assertEqual(info['difficulty'], 3)
+        self.assertEqual(info['question']['difficulty'], 3)
+        info = json.loads(self.client().post(url, json={'correct': False}).data)
+        self.assertEqual(info['difficulty'], 2)
+
+        # questions are drawn from the shared pools, never twice in one session
+        served = [json.loads(self.client().post(url).data)['question']['id'] for _ in range(10)]
+        self.assertEqual(len(set(served)), 10)
+
+    def test_quiz_pack(self):
+        """Tests packs are deterministic per seed, cached, and rebuilt when a question in them changes"""
+
+        url = '/api/v1.1/quizzes/packs?category=1&seed=event&size=500'
+        first = self.client().get(url)
+        info = json.loads(first.data)
+        self.assertEqual(info['success'], True)
+        self.assertEqual(info['size'], len(info['questions']))
+        self.assertTrue(all(q['category'] == 2 for q in info['questions']))
+        # another process draws the same pack from the same seed
+        self.assertEqual(create_app().test_client().get(url).data, first.data)
+        self.assertEqual(self.client().get(url).data, first.data)
+        self.assertEqual(self.app.extensions['quiz_packs'].stats()['hits'], 1)
+
+        # the mix splits the pack between difficulties by weight
+        other = '/api/v1.1/quizzes/packs?category=3&seed=event&size=3&mix=1:1,2:2'
+        info = json.loads(self.client().get(other).data)
+        self.assertEqual(sorted(q['difficulty'] for q in info['questions']), [1, 2, 2])
+
+        # a new question in the category rebuilds its packs only
+        que = dict(self.new_question, category='2')
+        created = json.loads(self.client().post('/api/v2.0/questions', json=que).data)['created']
+        info = json.loads(self.client().get(url).data)
+        self.assertIn(created, [q['id'] for q in info['questions']])
+        self.client().get(other)
+        self.assertEqual(self.app.extensions['quiz_packs'].stats()['hits'], 2)
+        self.client().delete('/api/v1.0/questions/{}'.format(created))
+        self.assertEqual(self.client().get(url).data, first.data)
+
+    def test_quiz_pack_builds_concurrently(self):
+        """Tests a slow pack build does not hold up other packs and identical requests share it"""
+
+        packs = self.app.extensions['quiz_packs']
+        flight = self.app.extensions['single_flight']
+        release = threading.Event()
+        calls, results = [], []
+
+        def slow():
+            calls.append(1)
+            release.wait(5)
+            return 'slow pack'
+
+        threads = [threading.Thread(target=lambda: results.append(packs.get(None, 'a', 10, None, slow)))
+                   for _ in range(2)]
+        threads[0].start()
+        while not calls:
+            release.wait(0.01)
+        threads[1].start()
+        while flight.coalesced < 1:
+            release.wait(0.01)
+        # another pack is built while the first build is still running
+        self.assertEqual(packs.get(None, 'b', 10, None, lambda: 'other pack'), 'other pack')
+        release.set()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['slow pack'] * 2)
+
+    def test_quiz_pack_fails(self):
+        """Tests quiz packs need a seed, a known category and a size within bounds"""
+
+        for url in ('/api/v1.1/quizzes/packs?size=5', '/api/v1.1/quizzes/packs?seed=1&category=99',
+                    '/api/v1.1/quizzes/packs?seed=1&category=-1', '/api/v1.1/quizzes/packs?seed=1&size=0',
+                    '/api/v1.1/quizzes/packs?seed=1&size=100000', '/api/v1.1/quizzes/packs?seed=1&mix=hard'):
+            info = json.loads(self.client().get(url).data)
+            self.assertEqual(info['success'], False)
+            self.assertEqual(info['message'], 'bad request')
+
+    def test_leaderboard(self):
+        """Tests submitted games are written to the scores table in the background and ranked once stored"""
+
+        player = 'player-{}'.format(os.getpid())
+        best = json.loads(self.client().get('/api/v1.1/leaderboard?limit=1').data)['scores']
+        top = best[0]['score'] + 1 if best else 1
+        body = {'player': player, 'score': top, 'total': top, 'quiz_category': {'type': 'Science', 'id': '0'}}
+        info = json.loads(self.client().post('/api/v1.1/scores', json=body).data)
+        self.assertEqual(info['success'], True)
+        self.assertEqual(info['rank'], 1)
+        self.assertEqual(info['category_rank'], 1)
+
+        info = json.loads(self.client().get('/api/v1.1/categories/0/leaderboard').data)
+        self.assertEqual(info['scores'][0]['player'], player)
+        self.assertEqual(info['current_category'], 'Science')
+
+        # it was stored before it was ranked, so a fresh app rebuilds the same board
+        info = json.loads(create_app().test_client().get('/api/v1.1/leaderboard?limit=1').data)
+        self.assertEqual(info['scores'][0]['player'], player)
+
+        # a game that fails to store is never ranked
+        future = self.app.extensions['score_writer'].submit({'player': player + '-lost', 'category': 99999,
+                                                             'score': top + 1, 'total': top + 1})
+        self.assertRaises(Exception, future.result, 5)
+        info = json.loads(self.client().get('/api/v1.1/leaderboard?limit=1').data)
+        self.assertEqual(info['scores'][0]['player'], player)
+
+        # shutdown writes what is still queued
+        self.app.extensions['score_writer'].submit({'player': player, 'category': 1, 'score': 0, 'total': 0})
+        self.app.extensions['shutdown']()
+        self.assertEqual(self.app.extensions['score_writer'].stats()['queued'], 0)
+
+        info = json.loads(self.client().post('/api/v1.1/scores', json={'player': '', 'score': 1}).data)
+        self.assertEqual(info['success'], False)
+
+    def test_leaderboard_queue_full(self):
+        """Tests a game the score writer has no room for answers success false instead of a 500"""
+
+        def full(item, timeout=5):
+            raise queue.Full()
+
+        self.app.extensions['score_writer'].submit = full
+        resp = self.client().post('/api/v1.1/scores', json={'player': 'queued out', 'score': 1})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(json.loads(resp.data)['success'], False)
+
     def test_play_quiz_fails(self):
         """Tests playing quiz game failure 400"""
 
@@ -1,8 +1,10 @@
 import React, { Component } from 'react';
+import $ from 'jquery';
 
 class Search extends Component {
   state = {
     query: '',
+    suggestions: [],
   };
 
   getInfo = (event) => {
@@ -14,6 +16,30 @@ class Search extends Component {
     this.setState({
       query: this.search.value,
     });
+    this.getSuggestions(this.search.value);
+  };
+
+  getSuggestions = (query) => {
+    // only the latest keystroke's suggestions matter
+    if (this.pending) {
+      this.pending.abort();
+    }
+    if (!query.trim()) {
+      this.setState({ suggestions: [] });
+      return;
+    }
+    this.pending = $.ajax({
+      url: `/api/v3.0/questions/autocomplete`,
+      type: 'GET',
+      data: { q: query, limit: 8 },
+      success: (result) => {
+        this.setState({ suggestions: result.suggestions });
+        return;
+      },
+      error: () => {
+        return;
+      },
+    });
   };
 
   render() {
@@ -23,7 +49,13 @@ class Search extends Component {
           placeholder='Search questions...'
           ref={(input) => (this.search = input)}
           onChange={this.handleInputChange}
+          list='question-suggestions'
         />
+        <datalist id='question-suggestions'>
+          {this.state.suggestions.map((s) => (
+            <option key={s.id} value={s.question} />
+          ))}
+        </datalist>
         <input type='submit' value='Submit' className='button' />
       </form>
     );